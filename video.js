@@ -11,6 +11,11 @@ const router = express.Router();
 const uploadDir = path.join(__dirname, "../uploads");
 const processedDir = path.join(__dirname, "../uploads/processed");
 const aiDir = path.join(__dirname, "../ai");
+const pythonScript = path.join(aiDir, "video_analyzer.py");
+// Spawn Python process (use 'py' on Windows, 'python3' on Linux/Mac)
+const pythonCmd = process.platform === "win32" ? "py" : "python3";
+const maxDurationSeconds = 30;  // Limit to 30 seconds for faster processing
+const probeTimeoutMs = 10000;  // A probe normally takes well under a second
 
 [uploadDir, processedDir].forEach(dir => {
     if (!fs.existsSync(dir)) {
@@ -42,53 +47,118 @@ const upload = multer({
 });
 
 /**
- * Run Python video analyzer
+ * Apply a JSON update line from the analyzer to its job
  */
-function runAnalyzer(inputPath, jobId) {
-    const outputVideo = path.join(processedDir, `processed-${jobId}.mp4`);
-    const outputJson = path.join(processedDir, `results-${jobId}.json`);
-    const pythonScript = path.join(aiDir, "video_analyzer.py");
+function applyAnalyzerUpdate(job, jobId, update) {
+    if (update.progress) {
+        job.progress = update.progress;
+        job.message = `جاري تحليل الفيديو... ${update.progress}%`;
+        // Throughput and ms/frame per stage so far (instrumented jobs)
+        if (update.stagesMs) {
+            job.stats = { fps: update.fps, stagesMs: update.stagesMs };
+        }
+    }
+    if (update.status === "starting") {
+        // The worker picked the job up: it is no longer waiting in the queue
+        job.status = "processing";
+        job.message = update.message || "جاري التحضير...";
+    }
+    if (update.status === "event") {
+        // Live counts while the video is analyzed (one timeline event per second)
+        if (update.type === "timeline") {
+            job.live = {
+                time: update.time,
+                activeStaff: update.activeStaff,
+                inactiveStaff: update.inactiveStaff,
+                customers: update.customers,
+            };
+        }
+        return;
+    }
+    if (update.status === "complete") {
+        job.status = "complete";
+        job.progress = 100;
+        job.message = "اكتمل التحليل بنجاح!";
+        job.results = update.results;
+        if (update.results && update.results.profile) {
+            job.stats = update.results.profile;
+            console.log(`[AI] Job ${jobId} profile: ${JSON.stringify(update.results.profile.stagesMs)}`);
+        }
+        // With streamed events the timeline is only in the results file
+        if (update.results && !update.results.timeline) {
+            try {
+                const outputJson = path.join(processedDir, `results-${jobId}.json`);
+                job.results = JSON.parse(fs.readFileSync(outputJson, "utf-8"));
+            } catch (e) {
+                job.results.timeline = [];
+            }
+        }
+        job.outputVideo = `/uploads/processed/processed-${jobId}.mp4`;
+    }
+    if (update.status === "error") {
+        job.status = "error";
+        job.message = "حدث خطأ أثناء تحليل الفيديو";
+        job.error = update.error;
+    }
+}
 
-    const job = jobs.get(jobId);
-    if (!job) return;
+/**
+ * Fall back to the results file if the analyzer stopped without a "complete" message
+ */
+function finishFromResultsFile(job, jobId, outputJson) {
+    if (job.status !== "processing" && job.status !== "queued") return;
+    if (fs.existsSync(outputJson)) {
+        try {
+            const results = JSON.parse(fs.readFileSync(outputJson, "utf-8"));
+            job.status = "complete";
+            job.progress = 100;
+            job.message = "اكتمل التحليل بنجاح!";
+            job.results = results;
+            job.outputVideo = `/uploads/processed/processed-${jobId}.mp4`;
+            return;
+        } catch (e) {
+            job.status = "error";
+            job.message = "فشل قراءة نتائج التحليل";
+            return;
+        }
+    }
+    job.status = "error";
+    job.message = "حدث خطأ أثناء تحليل الفيديو";
+}
 
-    job.status = "processing";
-    job.message = "جاري تحميل نموذج الذكاء الاصطناعي...";
+/**
+ * Persistent Python analyzer worker (--serve mode).
+ * The YOLO model is loaded once and reused for every upload; jobs are sent
+ * as JSON lines on stdin and every update line carries its jobId.
+ * Jobs run one at a time (one model in memory): later uploads stay "queued"
+ * until the worker starts them, and /status reports their queue position.
+ */
+let analyzerWorker = null;
 
-    // Spawn Python process (use 'py' on Windows, 'python3' on Linux/Mac)
-    const pythonCmd = process.platform === "win32" ? "py" : "python3";
-    console.log(`[AI] Starting Python analyzer: ${pythonCmd} ${pythonScript}`);
-    console.log(`[AI] Input: ${inputPath}`);
+function getAnalyzerWorker() {
+    if (analyzerWorker) return analyzerWorker;
 
-    const pythonProcess = spawn(pythonCmd, [
-        pythonScript,
-        "--input", inputPath,
-        "--output-video", outputVideo,
-        "--output-json", outputJson,
-        "--max-duration", "30"  // Limit to 30 seconds for faster processing
-    ]);
+    console.log(`[AI] Starting Python analyzer worker: ${pythonCmd} ${pythonScript} --serve`);
 
-    let lastProgress = 0;
+    const worker = spawn(pythonCmd, [pythonScript, "--serve"]);
+    worker.pendingJobs = new Set();
+    analyzerWorker = worker;
 
-    pythonProcess.stdout.on("data", (data) => {
-        const lines = data.toString().split("\n").filter(l => l.trim());
+    let buffer = "";
+    worker.stdout.on("data", (data) => {
+        buffer += data.toString();
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
         for (const line of lines) {
+            if (!line.trim()) continue;
             try {
                 const update = JSON.parse(line);
-                if (update.progress) {
-                    lastProgress = update.progress;
-                    job.progress = update.progress;
-                    job.message = `جاري تحليل الفيديو... ${update.progress}%`;
-                }
-                if (update.status === "starting") {
-                    job.message = update.message || "جاري التحضير...";
-                }
-                if (update.status === "complete") {
-                    job.status = "complete";
-                    job.progress = 100;
-                    job.message = "اكتمل التحليل بنجاح!";
-                    job.results = update.results;
-                    job.outputVideo = `/uploads/processed/processed-${jobId}.mp4`;
+                if (!update.jobId) continue;
+                const job = jobs.get(update.jobId);
+                if (!job) continue;
+                applyAnalyzerUpdate(job, update.jobId, update);
+                if (job.status === "complete" || job.status === "error") {
+                    worker.pendingJobs.delete(update.jobId);
                 }
             } catch (e) {
                 // Non-JSON output, ignore
@@ -96,40 +166,116 @@ function runAnalyzer(inputPath, jobId) {
         }
     });
 
-    pythonProcess.stderr.on("data", (data) => {
+    worker.stderr.on("data", (data) => {
         console.error(`Python stderr: ${data}`);
     });
 
-    pythonProcess.on("close", (code) => {
-        if (code !== 0 && job.status !== "complete") {
-            job.status = "error";
-            job.message = "حدث خطأ أثناء تحليل الفيديو";
-            job.error = `Process exited with code ${code}`;
-        } else if (job.status === "processing") {
-            // Check if JSON results exist
-            if (fs.existsSync(outputJson)) {
-                try {
-                    const results = JSON.parse(fs.readFileSync(outputJson, "utf-8"));
-                    job.status = "complete";
-                    job.progress = 100;
-                    job.message = "اكتمل التحليل بنجاح!";
-                    job.results = results;
-                    job.outputVideo = `/uploads/processed/processed-${jobId}.mp4`;
-                } catch (e) {
-                    job.status = "error";
-                    job.message = "فشل قراءة نتائج التحليل";
-                }
+    const onExit = (err) => {
+        if (analyzerWorker === worker) analyzerWorker = null;
+        for (const jobId of worker.pendingJobs) {
+            const job = jobs.get(jobId);
+            if (!job) continue;
+            if (err) {
+                job.status = "error";
+                job.message = "فشل تشغيل محلل الفيديو";
+                job.error = err.message;
+            } else {
+                finishFromResultsFile(job, jobId, path.join(processedDir, `results-${jobId}.json`));
             }
         }
+        worker.pendingJobs.clear();
+    };
+    worker.on("close", (code) => {
+        console.log(`[AI] Analyzer worker exited with code ${code}`);
+        onExit(null);
     });
+    worker.on("error", (err) => onExit(err));
+    // A job written after the worker died fails with EPIPE here, before "close"
+    worker.stdin.on("error", (err) => onExit(err));
 
-    pythonProcess.on("error", (err) => {
-        job.status = "error";
-        job.message = "فشل تشغيل محلل الفيديو";
-        job.error = err.message;
+    return worker;
+}
+
+/**
+ * 1-based position of a queued job among the jobs waiting for the worker
+ */
+function queuePosition(jobId) {
+    if (!analyzerWorker) return undefined;
+    let position = 0;
+    for (const pendingId of analyzerWorker.pendingJobs) {
+        const pending = jobs.get(pendingId);
+        if (pending && pending.status === "queued") position++;
+        if (pendingId === jobId) return position;
+    }
+    return undefined;
+}
+
+/**
+ * Probe an upload (OpenCV only, no model, separate short-lived process):
+ * resolves with its fps, size, frame count and estimated processing time,
+ * rejects if the file cannot be decoded or the probe takes longer than
+ * probeTimeoutMs
+ */
+function probeVideo(inputPath) {
+    return new Promise((resolve, reject) => {
+        const probe = spawn(pythonCmd, [pythonScript, "--probe", "--input", inputPath,
+            "--max-duration", String(maxDurationSeconds)]);
+        let output = "";
+        let timedOut = false;
+        // Files that make OpenCV hang must not keep the upload request open
+        const timer = setTimeout(() => {
+            timedOut = true;
+            probe.kill("SIGKILL");
+        }, probeTimeoutMs);
+        probe.stdout.on("data", (data) => { output += data.toString(); });
+        probe.on("error", (err) => {
+            clearTimeout(timer);
+            reject(err);
+        });
+        probe.on("close", () => {
+            clearTimeout(timer);
+            if (timedOut) return reject(new Error(`Probe timed out after ${probeTimeoutMs / 1000}s`));
+            try {
+                const update = JSON.parse(output.trim().split("\n").pop());
+                if (update.status === "complete") return resolve(update.probe);
+                reject(new Error(update.error));
+            } catch (e) {
+                reject(new Error("Invalid probe output"));
+            }
+        });
     });
 }
 
+/**
+ * Run Python video analyzer
+ */
+function runAnalyzer(inputPath, jobId) {
+    const outputVideo = path.join(processedDir, `processed-${jobId}.mp4`);
+    const outputJson = path.join(processedDir, `results-${jobId}.json`);
+
+    const job = jobs.get(jobId);
+    if (!job) return;
+
+    job.status = "queued";
+    job.message = "في قائمة الانتظار...";
+
+    console.log(`[AI] Input: ${inputPath}`);
+
+    const worker = getAnalyzerWorker();
+    worker.pendingJobs.add(jobId);
+    worker.stdin.write(JSON.stringify({
+        jobId,
+        input: inputPath,
+        outputVideo,
+        outputJson,
+        maxDuration: maxDurationSeconds,
+        events: true,
+        instrument: true,
+        // Re-uploads of the same footage reuse its detections
+        detectionCache: path.join(processedDir, "detection-cache")
+    }) + "\n");
+}
+
 /**
  * POST /api/video/upload
  * Upload video and start analysis
@@ -140,6 +286,15 @@ router.post("/upload", auth, upload.single("video"), async (req, res) => {
             return res.status(400).json({ error: "الرجاء رفع ملف فيديو" });
         }
 
+        // Reject files that cannot be decoded before they take a worker
+        let probe;
+        try {
+            probe = await probeVideo(req.file.path);
+        } catch (err) {
+            fs.unlink(req.file.path, () => {});
+            return res.status(400).json({ error: "تعذر قراءة ملف الفيديو", details: err.message });
+        }
+
         const jobId = `job-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`;
 
         // Create job entry
@@ -150,6 +305,7 @@ router.post("/upload", auth, upload.single("video"), async (req, res) => {
             message: "تم استلام الفيديو، جاري التحضير...",
             inputFile: req.file.filename,
             inputPath: req.file.path,
+            probe,
             createdAt: new Date().toISOString()
         });
 
@@ -161,6 +317,7 @@ router.post("/upload", auth, upload.single("video"), async (req, res) => {
         res.json({
             message: "تم رفع الفيديو بنجاح",
             jobId: jobId,
+            probe,
             file: {
                 filename: req.file.filename,
                 path: `/uploads/${req.file.filename}`,
@@ -188,7 +345,10 @@ router.get("/status/:jobId", auth, (req, res) => {
         id: job.id,
         status: job.status,
         progress: job.progress,
-        message: job.message
+        message: job.message,
+        live: job.live,
+        stats: job.stats,
+        queuePosition: job.status === "queued" ? queuePosition(jobId) : undefined
     });
 });
 
@@ -6,9 +6,17 @@ Refactored for CLI usage with Node.js integration
 """
 
 import argparse
+import glob
+import hashlib
+import itertools
 import json
 import sys
 import os
+import pickle
+import queue
+import signal
+import threading
+import time
 
 # Suppress TensorFlow/PyTorch warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -17,29 +25,87 @@ import cv2
 import numpy as np
 from datetime import timedelta
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# Try to import YOLO - will fail gracefully if not installed
-try:
-    from ultralytics import YOLO
-    import torch
-    # Kaggle-safe torch load
-    _original_load = torch.load
-    def safe_load(*args, **kwargs):
-        kwargs["weights_only"] = False
-        return _original_load(*args, **kwargs)
-    torch.load = safe_load
-except ImportError as e:
-    print(json.dumps({"error": f"Missing dependency: {e}. Run: pip install ultralytics opencv-python-headless numpy"}))
-    sys.exit(1)
+# ultralytics/torch are imported on first use by import_yolo(): the exported
+# (ONNX/OpenVINO) detector backends run without them
+YOLO = None
 
 # ===============================
 # CONFIGURATION
 # ===============================
 # Using YOLOv8 NANO for fast processing (6MB)
 YOLO_MODEL = "yolov8n.pt"
+# Detector backend: "torch" runs YOLO_MODEL with ultralytics/PyTorch; "onnx"
+# (onnxruntime) and "openvino" run its ONNX export, created next to the
+# weights on first use. "-int8" runs a dynamically quantized copy of the export.
+DETECTOR_BACKEND = "torch"
+DETECTOR_BACKENDS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+# --check-backend: frames compared and minimum share of boxes both backends agree on
+BACKEND_CHECK_FRAMES = 60
+BACKEND_CHECK_MIN_AGREEMENT = 0.95
 CONF_THRESHOLD = 0.35
 IOU_THRESHOLD = 0.45
 IMG_SIZE = 640
+# Frames sent to the model per call (1 = frame-by-frame)
+DETECTION_BATCH_SIZE = 4
+# Max batches buffered between pipeline stages (--pipeline)
+PIPELINE_QUEUE_SIZE = 4
+# Max bytes of decoded frames in flight across all pipeline stages: batches
+# grow with the detection stride, so the queue size alone does not bound memory
+PIPELINE_MAX_BYTES = 256 * 1024 ** 2
+
+# Detection stride: run YOLO on every k-th frame, extrapolate tracks in between.
+# Tracking counters (STAFF_CONSISTENT_FRAMES, GROUP_*_FRAMES, ...) keep counting
+# video frames because extrapolated frames go through the tracker too, so they
+# mean the same amount of time at any stride.
+DETECTION_STRIDE = 1
+# Adaptive stride: detect early when the scene or the people move fast
+ADAPTIVE_MAX_STRIDE = 5
+ADAPTIVE_MOTION_THRESHOLD = 6.0   # mean abs gray diff (0-255) vs last detected frame
+ADAPTIVE_SPEED_THRESHOLD_PX = 6.0  # px/frame of the fastest detected person
+MOTION_THUMB_WIDTH = 160
+# Motion gate: frames that barely differ from the last detected one reuse its
+# detections instead of running the detector, at most MOTION_GATE_MAX_SKIP in a row
+MOTION_GATE_MAX_SKIP = 10
+MOTION_GATE_PIXEL_DIFF = 25         # gray level change (0-255) counted as motion
+MOTION_GATE_CHANGED_FRACTION = 0.001  # share of thumbnail pixels that must change
+
+# Detection cache (--detection-cache): raw detections per video/model/settings,
+# least recently used entries removed beyond this total size
+DETECTION_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Checkpoints (--checkpoint): wall-clock seconds between snapshots of a run's
+# tracker state, so a restarted job can --resume instead of starting over
+CHECKPOINT_INTERVAL_SECONDS = 60
+
+# Chunk length for --parallel-chunks (one long video split over workers)
+CHUNK_SECONDS = 60
+
+# --probe processing time estimate: ms per detected frame (detector) and per
+# frame (decode, tracking, drawing, encoding) with the torch backend on CPU;
+# video_analyzer_bench.py measures the per-frame side on your machine
+PROBE_DETECT_MS = 35.0
+PROBE_FRAME_MS = 4.0
+
+# Live streams (--live): timeline rows kept for the final results, reconnect tries
+LIVE_TIMELINE_KEEP = 3600
+LIVE_RECONNECT_ATTEMPTS = 5
+
+# Frame size the pixel values below (zone, distances, box sizes) are tuned for;
+# other resolutions get them scaled to their own size
+REFERENCE_SIZE = (640, 480)
+# Analysis resolution: frames are resized once after decoding to this width
+# (or (width, height)); None = analyze at the video's own size. Never upscales.
+WORKING_SIZE = None
+# Working-size resize: "area" averages the source pixels, so small, distant
+# people survive large downscales (e.g. 4K -> 960); "linear" is several times
+# faster but aliases them, which can cost detections
+RESIZE_INTERPOLATION = "area"
+RESIZE_INTERPOLATIONS = {"area": cv2.INTER_AREA, "linear": cv2.INTER_LINEAR}
+# Annotated video size: "working" (the analyzed frames) or "original" (boxes
+# scaled back onto the decoded frames)
+OUTPUT_RESOLUTION = "working"
 
 # Staff zone polygon (default - can be overridden)
 STAFF_ZONE = [
@@ -49,6 +115,12 @@ STAFF_ZONE = [
 # Detection settings - Single scale for speed
 ENABLE_MULTI_SCALE = False
 DETECTION_SCALES = [1.0]
+# Regions of interest: only these (x1, y1, x2, y2) frame rectangles are sent to
+# the detector (None = full frame). Each one can be split into cols x rows
+# overlapping tiles so small people get more of IMG_SIZE.
+DETECTION_ROIS = None
+DETECTION_TILES = (1, 1)
+TILE_OVERLAP = 0.25  # share of a tile's width/height shared with its neighbour
 MIN_APPEARANCES = 2
 
 # Tracking parameters
@@ -59,6 +131,9 @@ MAX_TIME_GAP_STAFF = 30.0
 
 # Staff detection settings
 BODY_COVERAGE_THRESHOLD = 0.75
+# "grid": share of a 10x10 grid of box points inside the zone (same as
+# calculate_body_coverage_in_zone), "area": exact share of box pixels in the zone
+COVERAGE_METHOD = "grid"
 STAFF_CONSISTENT_FRAMES = 3
 PERMANENT_STAFF_CLASSIFICATION = True
 STARTUP_GRACE_PERIOD_SECONDS = 0.3
@@ -73,7 +148,6 @@ MIN_HEIGHT = 30
 MIN_WIDTH = 20
 
 # Activity detection settings
-ACTIVITY_WINDOW_FRAMES = 15
 MOVEMENT_THRESHOLD = 3
 ACTIVE_CONFIRMATION_FRAMES = 2
 INACTIVE_CONFIRMATION_FRAMES = 8
@@ -93,6 +167,138 @@ GROUP_JOIN_FRAMES = 12
 GROUP_LEAVE_FRAMES = 12
 GROUP_MATCH_DIST_PX = 140
 GROUP_MIN_SIZE = 2
+# Group tracks not matched for this long are dropped (a group seen again later gets a new id)
+GROUP_TRACK_MAX_AGE_SEC = 10.0
+
+
+# Loaded models, keyed by (weights path, backend) (kept warm across jobs in --serve mode)
+_MODEL_CACHE = {}
+
+
+# ===============================
+# CAMERA PROFILES
+# ===============================
+# Per-camera settings: name -> (default, how the value scales with the frame
+# size). "x"/"y": horizontal/vertical lengths, "xy": distances, "area": box
+# areas, "points": zone polygon, "rects": ROI rectangles, None: not scaled.
+PROFILE_SETTINGS = {
+    # Frame size the pixel values below are given for (None = the video's own size)
+    "reference_size": (REFERENCE_SIZE, None),
+    "working_size": (WORKING_SIZE, None),
+    "resize_interpolation": (RESIZE_INTERPOLATION, None),
+    "output_resolution": (OUTPUT_RESOLUTION, None),
+    "staff_zone": (STAFF_ZONE, "points"),
+    "rois": (DETECTION_ROIS, "rects"),
+    "tiles": (DETECTION_TILES, None),
+    "backend": (None, None),  # None = DETECTOR_BACKEND (or the --serve default)
+    "conf_threshold": (CONF_THRESHOLD, None),
+    "iou_threshold": (IOU_THRESHOLD, None),
+    "detect_stride": (None, None),
+    "adaptive_stride": (False, None),
+    "motion_gate": (False, None),
+    "adaptive_speed_threshold_px": (ADAPTIVE_SPEED_THRESHOLD_PX, "xy"),
+    "min_appearances": (MIN_APPEARANCES, None),
+    "max_distance_customer": (MAX_DISTANCE_CUSTOMER, "xy"),
+    "max_distance_staff": (MAX_DISTANCE_STAFF, "xy"),
+    "max_time_gap_customer": (MAX_TIME_GAP_CUSTOMER, None),
+    "max_time_gap_staff": (MAX_TIME_GAP_STAFF, None),
+    "body_coverage_threshold": (BODY_COVERAGE_THRESHOLD, None),
+    "coverage_method": (COVERAGE_METHOD, None),
+    "staff_consistent_frames": (STAFF_CONSISTENT_FRAMES, None),
+    "permanent_staff_classification": (PERMANENT_STAFF_CLASSIFICATION, None),
+    "startup_grace_period_seconds": (STARTUP_GRACE_PERIOD_SECONDS, None),
+    "person_grace_period_seconds": (PERSON_GRACE_PERIOD_SECONDS, None),
+    "min_aspect_ratio": (MIN_ASPECT_RATIO, None),
+    "max_aspect_ratio": (MAX_ASPECT_RATIO, None),
+    "min_box_area": (MIN_BOX_AREA, "area"),
+    "max_box_area": (MAX_BOX_AREA, "area"),
+    "min_height": (MIN_HEIGHT, "y"),
+    "min_width": (MIN_WIDTH, "x"),
+    "movement_threshold": (MOVEMENT_THRESHOLD, "xy"),
+    "active_confirmation_frames": (ACTIVE_CONFIRMATION_FRAMES, None),
+    "inactive_confirmation_frames": (INACTIVE_CONFIRMATION_FRAMES, None),
+    "group_distance_px": (GROUP_DISTANCE_PX, "xy"),
+    "group_max_neighbors": (GROUP_MAX_NEIGHBORS, None),
+    "min_time_before_group_sec": (MIN_TIME_BEFORE_GROUP_SEC, None),
+    "speed_threshold_px": (SPEED_THRESHOLD_PX, "xy"),
+    "group_join_frames": (GROUP_JOIN_FRAMES, None),
+    "group_leave_frames": (GROUP_LEAVE_FRAMES, None),
+    "group_match_dist_px": (GROUP_MATCH_DIST_PX, "xy"),
+    "group_min_size": (GROUP_MIN_SIZE, None),
+    "group_track_max_age_sec": (GROUP_TRACK_MAX_AGE_SEC, None),
+}
+
+
+class CameraProfile:
+    """Zone, detection, tracking and group settings of one camera.
+
+    Defaults are the module constants above. Profiles are plain objects so
+    they can be sent to worker processes, and one warm --serve worker can
+    run every job with its own camera's profile.
+    """
+
+    def __init__(self, **settings):
+        for name, (default, _) in PROFILE_SETTINGS.items():
+            setattr(self, name, default)
+        self.update(settings)
+
+    def update(self, settings):
+        for name, value in settings.items():
+            if name not in PROFILE_SETTINGS:
+                raise ValueError(f"Unknown camera profile setting {name!r}")
+            setattr(self, name, value)
+        return self
+
+    def with_overrides(self, **settings):
+        """Copy with the given settings replaced; None values keep the profile's own."""
+        return CameraProfile(**vars(self)).update({k: v for k, v in settings.items() if v is not None})
+
+    def for_frame(self, width, height):
+        """Copy with the pixel settings scaled from reference_size to width x height."""
+        if self.reference_size is None or tuple(self.reference_size) == (width, height):
+            return self
+        sx = width / self.reference_size[0]
+        sy = height / self.reference_size[1]
+        scale = {"x": sx, "y": sy, "xy": (sx * sy) ** 0.5, "area": sx * sy}
+        scaled = CameraProfile(**vars(self))
+        scaled.reference_size = (width, height)
+        for name, (_, kind) in PROFILE_SETTINGS.items():
+            value = getattr(self, name)
+            if value is None or kind is None:
+                continue
+            if kind == "points":
+                value = [(int(round(x * sx)), int(round(y * sy))) for x, y in value]
+            elif kind == "rects":
+                value = [(x1 * sx, y1 * sy, x2 * sx, y2 * sy) for x1, y1, x2, y2 in value]
+            else:
+                value = value * scale[kind]
+            setattr(scaled, name, value)
+        return scaled
+
+
+def load_camera_profile(source=None):
+    """CameraProfile from a JSON profile file path, a dict of settings
+    (camelCase or snake_case keys), a CameraProfile or None (defaults).
+    A list of points is a staff zone polygon, as the third argument of
+    process_video() used to be, with defaults for everything else."""
+    if isinstance(source, CameraProfile):
+        return source
+    if source is None:
+        return CameraProfile()
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8') as f:
+            source = json.load(f)
+    if isinstance(source, (list, tuple)):
+        return CameraProfile(staff_zone=[tuple(point) for point in source])
+    return CameraProfile(**{profile_setting_name(key): value for key, value in source.items()})
+
+
+def profile_setting_name(key):
+    """snake_case profile setting name of a camelCase (or snake_case) key."""
+    return "".join("_" + c.lower() if c.isupper() else c for c in key)
+
+
+DEFAULT_PROFILE = CameraProfile()
 
 
 # ===============================
@@ -116,18 +322,18 @@ def point_in_polygon(point, polygon):
     return inside
 
 
-def is_valid_person_box(bbox, frame_width, frame_height):
+def is_valid_person_box(bbox, frame_width, frame_height, profile=DEFAULT_PROFILE):
     x1, y1, x2, y2 = bbox
     width = x2 - x1
     height = y2 - y1
-    if width < MIN_WIDTH or height < MIN_HEIGHT:
+    if width < profile.min_width or height < profile.min_height:
         return False
     area = width * height
-    if area < MIN_BOX_AREA or area > MAX_BOX_AREA:
+    if area < profile.min_box_area or area > profile.max_box_area:
         return False
     if height > 0:
         aspect_ratio = width / height
-        if aspect_ratio < MIN_ASPECT_RATIO or aspect_ratio > MAX_ASPECT_RATIO:
+        if aspect_ratio < profile.min_aspect_ratio or aspect_ratio > profile.max_aspect_ratio:
             return False
     frame_area = frame_width * frame_height
     if area > frame_area * 0.5:
@@ -151,6 +357,59 @@ def calculate_body_coverage_in_zone(bbox, polygon, grid_size=10):
     return points_inside / total_points if total_points > 0 else 0
 
 
+class ZoneMask:
+    """Staff zone rasterized once per run, for coverage of many boxes at once.
+
+    coverage() samples the same grid of box points as
+    calculate_body_coverage_in_zone, but looks them up in the mask instead of
+    running point_in_polygon. Points are rounded to the nearest pixel, so the
+    two only disagree for grid points within about one pixel of the zone edge:
+    each such point moves a box's coverage by 1 / grid_size**2. A box with a
+    row and a column of points along zone edges can differ by up to
+    (2 * grid_size - 1) / grid_size**2 (0.19 for grid_size=10). On 20k random
+    boxes the mean difference is about 0.002 and the largest 0.11, and about
+    0.1% of the boxes land on the other side of BODY_COVERAGE_THRESHOLD, so
+    a borderline person can be classified differently.
+    area_coverage() uses the integral image for an O(1) exact pixel share.
+    """
+
+    def __init__(self, polygon, width, height):
+        pts = np.array(polygon, np.int32).reshape((-1, 1, 2))
+        mask_w = max(int(width), int(pts[:, 0, 0].max())) + 2
+        mask_h = max(int(height), int(pts[:, 0, 1].max())) + 2
+        self.mask = np.zeros((mask_h, mask_w), np.uint8)
+        cv2.fillPoly(self.mask, [pts], 1)
+        self.integral = cv2.integral(self.mask)
+
+    def coverage(self, boxes, grid_size=10):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return np.zeros(0)
+        steps = np.linspace(0.0, 1.0, grid_size)
+        xs = np.rint(boxes[:, 0:1] + (boxes[:, 2:3] - boxes[:, 0:1]) * steps).astype(np.int64)
+        ys = np.rint(boxes[:, 1:2] + (boxes[:, 3:4] - boxes[:, 1:2]) * steps).astype(np.int64)
+        mask_h, mask_w = self.mask.shape
+        x_ok = (xs >= 0) & (xs < mask_w)
+        y_ok = (ys >= 0) & (ys < mask_h)
+        inside = self.mask[np.clip(ys, 0, mask_h - 1)[:, None, :], np.clip(xs, 0, mask_w - 1)[:, :, None]]
+        inside = inside.astype(bool) & x_ok[:, :, None] & y_ok[:, None, :]
+        return inside.reshape(len(boxes), -1).mean(axis=1)
+
+    def area_coverage(self, boxes):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return np.zeros(0)
+        mask_h, mask_w = self.mask.shape
+        x1 = np.clip(np.rint(boxes[:, 0]), 0, mask_w).astype(np.int64)
+        x2 = np.clip(np.rint(boxes[:, 2]), 0, mask_w).astype(np.int64)
+        y1 = np.clip(np.rint(boxes[:, 1]), 0, mask_h).astype(np.int64)
+        y2 = np.clip(np.rint(boxes[:, 3]), 0, mask_h).astype(np.int64)
+        ii = self.integral
+        inside = ii[y2, x2] - ii[y1, x2] - ii[y2, x1] + ii[y1, x1]
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return np.where(areas > 0, inside / np.maximum(areas, 1e-9), 0.0)
+
+
 def calculate_distance(p1, p2):
     return np.sqrt((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)
 
@@ -179,25 +438,33 @@ def format_time_short(sec):
 # ACTIVITY TRACKER
 # ===============================
 class ActivityTracker:
-    def __init__(self, window_size=ACTIVITY_WINDOW_FRAMES):
-        self.position_history = deque(maxlen=window_size)
+    __slots__ = ('prev_position', 'last_position', 'positions_seen', 'current_state',
+                 'state_start_time', 'state_durations', 'active_frame_count',
+                 'inactive_frame_count', 'initialized', 'profile')
+
+    def __init__(self, profile=DEFAULT_PROFILE):
+        # Movement is measured between the last two positions only
+        self.prev_position = None
+        self.last_position = None
+        self.positions_seen = 0
         self.current_state = "active"
         self.state_start_time = None
-        self.state_durations = defaultdict(float)
-        self.movement_scores = deque(maxlen=10)
+        self.state_durations = {'active': 0.0, 'inactive': 0.0}
         self.active_frame_count = 0
         self.inactive_frame_count = 0
         self.initialized = False
+        self.profile = profile
 
     def update(self, position, bbox, current_time):
-        self.position_history.append(position)
-        if len(self.position_history) < 2:
+        self.prev_position = self.last_position
+        self.last_position = position
+        self.positions_seen = min(self.positions_seen + 1, 2)
+        if self.positions_seen < 2:
             return "active"
         movement = self._calculate_recent_movement()
-        self.movement_scores.append(movement)
-        if not self.initialized and len(self.position_history) >= 2:
+        if not self.initialized and self.positions_seen >= 2:
             self.initialized = True
-            self.current_state = "active" if movement > MOVEMENT_THRESHOLD else "inactive"
+            self.current_state = "active" if movement > self.profile.movement_threshold else "inactive"
             self.state_start_time = current_time
             return self.current_state
         new_state = self._determine_state(movement)
@@ -210,21 +477,20 @@ class ActivityTracker:
         return self.current_state
 
     def _calculate_recent_movement(self):
-        if len(self.position_history) < 2:
+        if self.positions_seen < 2:
             return 0
-        positions = list(self.position_history)
-        return calculate_distance(positions[-2], positions[-1])
+        return calculate_distance(self.prev_position, self.last_position)
 
     def _determine_state(self, movement):
-        if movement > MOVEMENT_THRESHOLD:
+        if movement > self.profile.movement_threshold:
             self.active_frame_count += 1
             self.inactive_frame_count = 0
-            if self.active_frame_count >= ACTIVE_CONFIRMATION_FRAMES:
+            if self.active_frame_count >= self.profile.active_confirmation_frames:
                 return "active"
         else:
             self.inactive_frame_count += 1
             self.active_frame_count = 0
-            if self.inactive_frame_count >= INACTIVE_CONFIRMATION_FRAMES:
+            if self.inactive_frame_count >= self.profile.inactive_confirmation_frames:
                 return "inactive"
         return self.current_state
 
@@ -253,7 +519,159 @@ def get_activity_color(state):
 # ===============================
 # DETECTION FUNCTIONS
 # ===============================
-def detect_multi_scale(model, frame, conf_threshold, scales):
+def import_yolo():
+    """Import ultralytics (and torch) on first use and return the YOLO class."""
+    global YOLO
+    if YOLO is None:
+        try:
+            from ultralytics import YOLO as yolo_class
+            import torch
+        except ImportError as e:
+            raise ImportError(f"Missing dependency: {e}. Run: pip install ultralytics opencv-python-headless numpy")
+        # Kaggle-safe torch load
+        _original_load = torch.load
+        def safe_load(*args, **kwargs):
+            kwargs["weights_only"] = False
+            return _original_load(*args, **kwargs)
+        torch.load = safe_load
+        YOLO = yolo_class
+    return YOLO
+
+
+def export_onnx(model_path=YOLO_MODEL, int8=False):
+    """Path of the ONNX export of model_path, exported (and quantized) on first use."""
+    onnx_path = model_path
+    if not model_path.endswith(".onnx"):
+        onnx_path = os.path.splitext(model_path)[0] + ".onnx"
+        if not os.path.exists(onnx_path):
+            onnx_path = str(import_yolo()(model_path).export(format="onnx", imgsz=IMG_SIZE, dynamic=True))
+    if not int8:
+        return onnx_path
+
+    int8_path = os.path.splitext(onnx_path)[0] + ".int8.onnx"
+    if not os.path.exists(int8_path):
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:
+            raise ImportError(f"Missing dependency: {e}. Run: pip install onnxruntime")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+class ExportedDetector:
+    """YOLOv8 ONNX export run with onnxruntime or OpenVINO.
+
+    Does what ultralytics does around the network for person detection:
+    letterbox to IMG_SIZE, keep anchors whose best class is a person, NMS,
+    and map the boxes back to frame coordinates.
+    """
+
+    def __init__(self, onnx_path, runtime="onnx", threads=None):
+        if runtime == "openvino":
+            try:
+                import openvino as ov
+            except ImportError as e:
+                raise ImportError(f"Missing dependency: {e}. Run: pip install openvino")
+            core = ov.Core()
+            config = {"INFERENCE_NUM_THREADS": int(threads)} if threads else {}
+            compiled = core.compile_model(core.read_model(onnx_path), "CPU", config)
+            output = compiled.output(0)
+            self._infer = lambda blob: compiled([blob])[output]
+        else:
+            try:
+                import onnxruntime as ort
+            except ImportError as e:
+                raise ImportError(f"Missing dependency: {e}. Run: pip install onnxruntime")
+            options = ort.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = int(threads)
+            session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+            input_name = session.get_inputs()[0].name
+            self._infer = lambda blob: session.run(None, {input_name: blob})[0]
+
+    @staticmethod
+    def letterbox(frame, square=False):
+        """Resize keeping aspect ratio and pad to a multiple of 32, or to IMG_SIZE
+        square when the batch mixes frame sizes (as ultralytics does)."""
+        height, width = frame.shape[:2]
+        ratio = min(IMG_SIZE / height, IMG_SIZE / width)
+        new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+        pad_w, pad_h = IMG_SIZE - new_w, IMG_SIZE - new_h
+        if not square:
+            pad_w, pad_h = pad_w % 32, pad_h % 32
+        pad_w, pad_h = pad_w / 2, pad_h / 2
+        if (new_w, new_h) != (width, height):
+            frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+        left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+        frame = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return frame, ratio, left, top
+
+    def detect(self, frames, conf_threshold, iou_threshold):
+        """(boxes, confs) arrays of the people in each frame, highest confidence first."""
+        square = len({frame.shape for frame in frames}) > 1
+        letterboxed = [self.letterbox(frame, square) for frame in frames]
+        blob = np.stack([lb[0] for lb in letterboxed])[..., ::-1].transpose(0, 3, 1, 2)
+        blob = np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+        output = self._infer(blob)  # (N, 4 + classes, anchors): cx, cy, w, h, class scores
+
+        results = []
+        for pred, frame, (_, ratio, pad_x, pad_y) in zip(output, frames, letterboxed):
+            scores = pred[4:]
+            keep = (scores[0] > conf_threshold) & (scores.argmax(axis=0) == 0)
+            cx, cy, w, h = pred[:4, keep]
+            confs = scores[0, keep]
+            boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+            kept = nms_indices(boxes, confs, iou_threshold)[:300] if len(confs) else []
+
+            boxes = boxes[kept]
+            boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / ratio).clip(0, frame.shape[1])
+            boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / ratio).clip(0, frame.shape[0])
+            results.append((boxes.astype(np.float32), confs[kept].astype(np.float32)))
+        return results
+
+
+def load_model(model_path=YOLO_MODEL, backend=DETECTOR_BACKEND, threads=None):
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend {backend!r} (expected one of {', '.join(DETECTOR_BACKENDS)})")
+    model = _MODEL_CACHE.get((model_path, backend))
+    if model is None:
+        if backend == "torch":
+            model = import_yolo()(model_path)
+        else:
+            runtime, _, variant = backend.partition("-")
+            model = ExportedDetector(export_onnx(model_path, int8=variant == "int8"), runtime, threads)
+        _MODEL_CACHE[(model_path, backend)] = model
+    return model
+
+
+def run_detector(model, frames, conf_threshold, iou_threshold=IOU_THRESHOLD, augment=False):
+    """(boxes, confs) arrays of the people in each frame, for any detector backend.
+
+    Models with a detect(frames, conf_threshold, iou_threshold) method (like
+    ExportedDetector, or a benchmark stub) are called directly.
+    """
+    if hasattr(model, "detect"):
+        return model.detect(frames, conf_threshold, iou_threshold)
+    results = model(
+        frames,
+        classes=[0],  # Only detect people
+        conf=conf_threshold,
+        iou=iou_threshold,
+        imgsz=IMG_SIZE,
+        verbose=False,
+        augment=augment
+    )
+    arrays = []
+    for result in results:
+        if result.boxes is not None and len(result.boxes) > 0:
+            arrays.append((result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy()))
+        else:
+            arrays.append((np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32)))
+    return arrays
+
+
+def detect_multi_scale(model, frame, conf_threshold, scales, iou_threshold=IOU_THRESHOLD):
     all_detections = []
     height, width = frame.shape[:2]
     for scale in scales:
@@ -262,28 +680,412 @@ def detect_multi_scale(model, frame, conf_threshold, scales):
         if new_w < 320 or new_h < 320:
             continue
         scaled_frame = cv2.resize(frame, (new_w, new_h))
-        results = model(
-            scaled_frame,
-            classes=[0],
-            conf=conf_threshold,
-            iou=IOU_THRESHOLD,
-            imgsz=IMG_SIZE,
-            verbose=False,
-            augment=True
-        )
-        if results[0].boxes is not None and len(results[0].boxes) > 0:
-            boxes = results[0].boxes.xyxy.cpu().numpy() / scale
-            confs = results[0].boxes.conf.cpu().numpy()
-            for box, conf in zip(boxes, confs):
-                all_detections.append({'box': box, 'conf': conf})
+        boxes, confs = run_detector(model, [scaled_frame], conf_threshold, iou_threshold, augment=True)[0]
+        for box, conf in zip(boxes / scale, confs):
+            all_detections.append({'box': box, 'conf': conf})
     return all_detections
 
 
+def detect_people_batch(model, frames, regions=None, profile=DEFAULT_PROFILE):
+    """Run person detection on a list of frames, returns one detections list per frame (in order).
+
+    With regions (DetectionRegions) only the ROI crops/tiles of each frame
+    are detected, all in the same model call, and mapped back to the frame.
+    """
+    if regions is not None:
+        crops = [crop for frame in frames for crop in regions.crops(frame)]
+        crop_detections = detect_people_batch(model, crops, profile=profile)
+        n = len(regions.rects)
+        return [regions.merge(crop_detections[i * n:(i + 1) * n]) for i in range(len(frames))]
+
+    if ENABLE_MULTI_SCALE:
+        batch_detections = []
+        for frame in frames:
+            detections = detect_multi_scale(model, frame, profile.conf_threshold, DETECTION_SCALES,
+                                            profile.iou_threshold)
+            batch_detections.append(non_max_suppression_custom(detections, iou_threshold=0.4))
+        return batch_detections
+
+    # Fast single-scale detection, all frames in one model call
+    batch_detections = []
+    for boxes, confs in run_detector(model, frames, profile.conf_threshold, profile.iou_threshold):
+        batch_detections.append([{'box': box, 'conf': conf} for box, conf in zip(boxes, confs)])
+    return batch_detections
+
+
+class DetectionRegions:
+    """ROI crops and tiles of a frame size, and merging their detections back.
+
+    Tiles overlap by TILE_OVERLAP. When merging, a box touching an inner
+    tile border is a cut part of a person: it is joined (box union) with the
+    box it mostly overlaps, whole boxes first. The remaining duplicates from
+    overlapping tiles or ROIs go through non_max_suppression_custom.
+    """
+
+    def __init__(self, rois, tiles, width, height, iou_threshold=IOU_THRESHOLD):
+        self.iou_threshold = iou_threshold
+        cols, rows = tiles
+        self.rects = []        # (x1, y1, x2, y2) crops in frame pixels
+        self.inner_edges = []  # (left, top, right, bottom): border shared with another tile
+        for x1, y1, x2, y2 in rois:
+            x1, y1 = max(0, int(x1)), max(0, int(y1))
+            x2, y2 = min(width, int(x2)), min(height, int(y2))
+            if x2 <= x1 or y2 <= y1:
+                raise ValueError(f"ROI {(x1, y1, x2, y2)} is outside the {width}x{height} frame")
+            step_x, step_y = (x2 - x1) / cols, (y2 - y1) / rows
+            pad_x, pad_y = step_x * TILE_OVERLAP / 2, step_y * TILE_OVERLAP / 2
+            for row in range(rows):
+                for col in range(cols):
+                    self.rects.append((
+                        int(max(x1, x1 + col * step_x - pad_x)),
+                        int(max(y1, y1 + row * step_y - pad_y)),
+                        int(min(x2, x1 + (col + 1) * step_x + pad_x)),
+                        int(min(y2, y1 + (row + 1) * step_y + pad_y)),
+                    ))
+                    self.inner_edges.append((col > 0, row > 0, col < cols - 1, row < rows - 1))
+
+    def crops(self, frame):
+        return [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in self.rects]
+
+    def merge(self, crop_detections):
+        detections, cut = [], []
+        for (x1, y1, x2, y2), edges, dets in zip(self.rects, self.inner_edges, crop_detections):
+            offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+            for det in dets:
+                box = det['box'] + offset
+                detections.append({'box': box, 'conf': det['conf']})
+                cut.append((edges[0] and box[0] <= x1 + 1) or (edges[1] and box[1] <= y1 + 1)
+                           or (edges[2] and box[2] >= x2 - 1) or (edges[3] and box[3] >= y2 - 1))
+        if len(self.rects) == 1:
+            return detections
+
+        kept, kept_cut = [], []
+        for i in sorted(range(len(detections)), key=lambda i: (cut[i], -detections[i]['conf'])):
+            det = detections[i]
+            for k, other in enumerate(kept):
+                if (cut[i] or kept_cut[k]) and overlap_of_smaller(det['box'], other['box']) >= 0.5:
+                    box = other['box']
+                    other['box'] = np.concatenate([np.minimum(box[:2], det['box'][:2]),
+                                                   np.maximum(box[2:], det['box'][2:])])
+                    kept_cut[k] = kept_cut[k] and cut[i]
+                    break
+            else:
+                kept.append(det)
+                kept_cut.append(cut[i])
+        return non_max_suppression_custom(kept, iou_threshold=self.iou_threshold)
+
+
+def overlap_of_smaller(box_a, box_b):
+    """Intersection area over the area of the smaller box."""
+    iw = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    ih = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    area = min((box_a[2] - box_a[0]) * (box_a[3] - box_a[1]), (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]))
+    if iw <= 0 or ih <= 0 or area <= 0:
+        return 0.0
+    return float(iw * ih / area)
+
+
+def make_detection_regions(profile, width, height):
+    """DetectionRegions of the profile for the frame size, or None when the full
+    frame is detected as is."""
+    cols, rows = profile.tiles or (1, 1)
+    if not profile.rois and (cols, rows) == (1, 1):
+        return None
+    return DetectionRegions(profile.rois or [(0, 0, width, height)], (max(1, int(cols)), max(1, int(rows))),
+                            width, height, profile.iou_threshold)
+
+
+def compare_backends(video_path, backend, reference="torch", num_frames=BACKEND_CHECK_FRAMES):
+    """Parity check: run two detector backends on the first frames of a video.
+
+    Boxes are paired greedily by IoU (>= 0.5). recall is the share of the
+    reference boxes the backend found, precision the share of the backend
+    boxes the reference also found; fps is measured after one warm-up call.
+    """
+    cap, fps, width, height, total_frames = open_video_capture(video_path)
+    try:
+        frames = next(read_frame_batches(cap, num_frames, num_frames), [])
+    finally:
+        cap.release()
+
+    report = {"backend": backend, "reference": reference, "frames": len(frames)}
+    detections = {}
+    for name in (reference, backend):
+        model = load_model(backend=name)
+        detect_people_batch(model, frames[:1])
+        start = time.perf_counter()
+        detections[name] = []
+        for i in range(0, len(frames), DETECTION_BATCH_SIZE):
+            detections[name].extend(detect_people_batch(model, frames[i:i + DETECTION_BATCH_SIZE]))
+        report[f"{name}Fps"] = round(len(frames) / max(time.perf_counter() - start, 1e-9), 1)
+
+    reference_boxes = backend_boxes = matched = 0
+    ious, conf_diffs = [], []
+    for ref_dets, test_dets in zip(detections[reference], detections[backend]):
+        reference_boxes += len(ref_dets)
+        backend_boxes += len(test_dets)
+        unmatched = list(range(len(test_dets)))
+        for ref in ref_dets:
+            scored = [(calculate_iou(ref['box'], test_dets[j]['box']), j) for j in unmatched]
+            if not scored:
+                break
+            iou, j = max(scored)
+            if iou >= 0.5:
+                unmatched.remove(j)
+                matched += 1
+                ious.append(iou)
+                conf_diffs.append(abs(float(ref['conf']) - float(test_dets[j]['conf'])))
+
+    report.update({
+        "referenceBoxes": reference_boxes,
+        "backendBoxes": backend_boxes,
+        "recall": round(matched / reference_boxes, 3) if reference_boxes else 1.0,
+        "precision": round(matched / backend_boxes, 3) if backend_boxes else 1.0,
+        "meanIoU": round(float(np.mean(ious)), 3) if ious else None,
+        "maxConfDiff": round(max(conf_diffs), 3) if conf_diffs else None,
+    })
+    report["ok"] = min(report["recall"], report["precision"]) >= BACKEND_CHECK_MIN_AGREEMENT
+    return report
+
+
+def motion_thumbnail(frame):
+    height, width = frame.shape[:2]
+    thumb_h = max(1, int(height * MOTION_THUMB_WIDTH / width))
+    small = cv2.resize(frame, (MOTION_THUMB_WIDTH, thumb_h), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def frame_motion_score(thumb, reference):
+    if reference is None:
+        return float('inf')
+    return float(cv2.absdiff(thumb, reference).mean())
+
+
+def frame_changed_fraction(thumb, reference):
+    """Share of thumbnail pixels that changed by more than MOTION_GATE_PIXEL_DIFF.
+
+    Unlike the mean difference, a single small person moving still counts.
+    """
+    if reference is None:
+        return 1.0
+    return cv2.countNonZero(cv2.compare(cv2.absdiff(thumb, reference), MOTION_GATE_PIXEL_DIFF,
+                                        cv2.CMP_GT)) / thumb.size
+
+
+class DetectionScheduler:
+    """Decides which frames go through the detector.
+
+    Fixed mode detects every `stride` frames. Adaptive mode uses `stride` as
+    the maximum gap and detects earlier when the frame differs from the last
+    detected one or when the fastest person moved quickly between the last
+    detections. Speed is measured from the detector output itself, so it is
+    known up to the previous inference call.
+
+    Motion gate mode detects as soon as the frame changed at all since the
+    last detected one (`stride` is then the maximum skip). The frames it
+    skips are static, so they reuse the last detections instead of being
+    extrapolated.
+    """
+
+    def __init__(self, stride=DETECTION_STRIDE, adaptive=False, motion_gate=False, profile=DEFAULT_PROFILE):
+        self.stride = max(1, int(stride))
+        self.profile = profile
+        self.adaptive = adaptive
+        self.motion_gate = motion_gate
+        self.last_detections = None
+        self.frames_since_detection = None
+        self.reference_thumb = None
+        self.track_speed = 0.0
+        self.last_centers = None
+        self.pending_gaps = deque()
+
+    def should_detect(self, frame):
+        if self.frames_since_detection is not None:
+            self.frames_since_detection += 1
+        detect = (self.frames_since_detection is None
+                  or self.frames_since_detection >= self.stride)
+        thumb = None
+        if self.adaptive or self.motion_gate:
+            thumb = motion_thumbnail(frame)
+        if self.adaptive and not detect:
+            detect = (self.track_speed >= self.profile.adaptive_speed_threshold_px
+                      or frame_motion_score(thumb, self.reference_thumb) >= ADAPTIVE_MOTION_THRESHOLD)
+        if self.motion_gate and not detect:
+            detect = frame_changed_fraction(thumb, self.reference_thumb) >= MOTION_GATE_CHANGED_FRACTION
+        if detect:
+            self.pending_gaps.append(self.frames_since_detection or 1)
+            self.frames_since_detection = 0
+            self.reference_thumb = thumb
+        return detect
+
+    def observe(self, detections):
+        """Feed back the detections of the frames selected by should_detect, in order."""
+        gap = self.pending_gaps.popleft() if self.pending_gaps else 1
+        self.last_detections = detections
+        centers = np.array([((d['box'][0]+d['box'][2])/2, (d['box'][1]+d['box'][3])/2)
+                            for d in detections], dtype=np.float32).reshape(-1, 2)
+        self.track_speed = 0.0
+        if self.last_centers is not None and len(centers) and len(self.last_centers):
+            dists = np.sqrt(((centers[:, None, :] - self.last_centers[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+            plausible = dists[dists <= self.profile.max_distance_customer]
+            if len(plausible):
+                self.track_speed = float(plausible.max()) / gap
+        self.last_centers = centers
+
+    def skipped_detections(self):
+        """Detections for a skipped frame: None (extrapolate), or the last ones under the motion gate."""
+        if not self.motion_gate or self.last_detections is None:
+            return None
+        return [dict(det) for det in self.last_detections]
+
+
+def pack_detections(frames_detections):
+    """Per-frame detections as compact arrays (counts, boxes, confs).
+
+    counts[i] is the number of boxes of frame i, or -1 for a frame that was
+    not run through the detector.
+    """
+    counts = np.array([-1 if dets is None else len(dets) for dets in frames_detections], dtype=np.int32)
+    boxes = [det['box'] for dets in frames_detections if dets for det in dets]
+    confs = [det['conf'] for dets in frames_detections if dets for det in dets]
+    return (counts,
+            np.array(boxes, dtype=np.float32).reshape(-1, 4),
+            np.array(confs, dtype=np.float32).reshape(-1))
+
+
+def unpack_detections(counts, boxes, confs):
+    """Inverse of pack_detections, yields one detections list (or None) per frame."""
+    offset = 0
+    for count in counts:
+        if count < 0:
+            yield None
+            continue
+        yield [{'box': boxes[offset + k], 'conf': confs[offset + k]} for k in range(count)]
+        offset += count
+
+
+def save_detection_log(path, packed, fps, width, height):
+    """Write a detection log: packed per-frame detections of a width x height
+    analysis at fps, for replay_detections()."""
+    counts, boxes, confs = packed
+    temp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, counts=counts, boxes=boxes, confs=confs, fps=fps, size=(width, height))
+    os.replace(temp_path, path)
+
+
+def load_detection_log(path):
+    """(packed detections, fps, width, height) of a detection log."""
+    with np.load(path) as data:
+        width, height = (int(v) for v in data["size"])
+        return (data["counts"], data["boxes"], data["confs"]), float(data["fps"]), width, height
+
+
+def concat_packed(parts):
+    """One (counts, boxes, confs) from packed parts in frame order."""
+    if not parts:
+        return pack_detections([])
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def video_content_hash(video_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(video_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """Raw per-frame detections on disk, so re-analyzing a video with other
+    zone, tracking or group settings skips decoding and inference.
+
+    Entries are keyed by the video's content hash, the model and every
+    setting that changes which frames are detected or what the detector
+    returns. Each is an .npz of pack_detections() arrays; reading one marks
+    it as recently used and the least recently used ones are removed once
+    the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DETECTION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(video_path, profile, batch_size, model_path=YOLO_MODEL):
+        settings = {
+            "video": video_content_hash(video_path),
+            "model": [model_path, profile.backend or DETECTOR_BACKEND, IMG_SIZE],
+            "multiScale": DETECTION_SCALES if ENABLE_MULTI_SCALE else None,
+            "size": list(profile.reference_size),
+            "batchSize": batch_size,
+        }
+        for name in ("conf_threshold", "iou_threshold", "rois", "tiles", "detect_stride",
+                     "adaptive_stride", "motion_gate", "resize_interpolation"):
+            settings[name] = getattr(profile, name)
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key, max_frames):
+        """Packed detections of the first max_frames frames, or None if not cached."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                counts, boxes, confs = data["counts"], data["boxes"], data["confs"]
+                complete = bool(data["complete"])
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        if len(counts) < max_frames and not complete:
+            return None
+        counts = counts[:max_frames]
+        total = int(counts[counts > 0].sum())
+        return counts, boxes[:total], confs[:total]
+
+    def store(self, key, packed, complete):
+        """Save packed detections; complete means they reach the end of the video."""
+        counts, boxes, confs = packed
+        temp_path = os.path.join(self.directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        np.savez(temp_path, counts=counts, boxes=boxes, confs=confs, complete=complete)
+        os.replace(temp_path, self._path(key))
+        self._evict(keep=self._path(key))
+
+    def _evict(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".npz") or name.endswith(".tmp.npz"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
 def non_max_suppression_custom(detections, iou_threshold=0.5):
     if len(detections) == 0:
         return []
     boxes = np.array([d['box'] for d in detections])
     scores = np.array([d['conf'] for d in detections])
+    return [detections[i] for i in nms_indices(boxes, scores, iou_threshold)]
+
+
+def nms_indices(boxes, scores, iou_threshold=0.5):
+    """Indices of the boxes kept by non-maximum suppression, highest score first."""
     x1, y1, x2, y2 = boxes[:,0], boxes[:,1], boxes[:,2], boxes[:,3]
     areas = (x2 - x1) * (y2 - y1)
     order = scores.argsort()[::-1]
@@ -301,81 +1103,97 @@ def non_max_suppression_custom(detections, iou_threshold=0.5):
         iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
         inds = np.where(iou <= iou_threshold)[0]
         order = order[inds + 1]
-    return [detections[i] for i in keep]
-
-
-def find_matching_person(current_box, current_position, current_time, people_data,
-                         max_distance_customer, max_distance_staff,
-                         max_time_gap_customer, max_time_gap_staff):
-    best_match = None
-    best_score = 0
-    for pid, data in people_data.items():
-        if data['last_seen'] is None:
+    return keep
+
+
+def match_detections_to_tracks(det_boxes, track_boxes, track_is_staff,
+                               max_distance_customer, max_distance_staff):
+    """Match a frame's detections against the active tracks.
+
+    Scores every detection x track pair at once (70% IoU, 30% closeness,
+    x1.2 for staff tracks) and assigns pairs greedily from the best score
+    down, so a track is claimed by at most one detection per frame.
+    Returns the matched track index (or None) for every detection.
+    """
+    n, m = len(det_boxes), len(track_boxes)
+    matches = [None] * n
+    if n == 0 or m == 0:
+        return matches
+
+    det = np.asarray(det_boxes, dtype=np.float64).reshape(-1, 4)
+    trk = np.asarray(track_boxes, dtype=np.float64).reshape(-1, 4)
+    staff = np.asarray(track_is_staff, dtype=bool)
+
+    det_c = (det[:, :2] + det[:, 2:]) / 2
+    trk_c = (trk[:, :2] + trk[:, 2:]) / 2
+    dist = np.sqrt(((det_c[:, None, :] - trk_c[None, :, :]) ** 2).sum(axis=2))
+
+    iw = np.minimum(det[:, None, 2], trk[None, :, 2]) - np.maximum(det[:, None, 0], trk[None, :, 0])
+    ih = np.minimum(det[:, None, 3], trk[None, :, 3]) - np.maximum(det[:, None, 1], trk[None, :, 1])
+    inter = np.where((iw >= 0) & (ih >= 0), iw * ih, 0.0)
+    det_area = (det[:, 2] - det[:, 0]) * (det[:, 3] - det[:, 1])
+    trk_area = (trk[:, 2] - trk[:, 0]) * (trk[:, 3] - trk[:, 1])
+    union = det_area[:, None] + trk_area[None, :] - inter
+    iou = np.where(union > 0, inter / np.where(union > 0, union, 1.0), 0.0)
+
+    max_dist = np.where(staff, max_distance_staff, max_distance_customer)[None, :]
+    score = (iou * 0.7) + (np.maximum(0.0, 1 - dist / max_dist) * 0.3)
+    score = np.where(staff[None, :], score * 1.2, score)
+    threshold = np.where(staff, 0.2, 0.3)[None, :]
+    valid = (dist <= max_dist) & (score > threshold)
+
+    pairs = np.flatnonzero(valid)
+    pairs = pairs[np.argsort(-score.ravel()[pairs], kind='stable')]
+    used_tracks = set()
+    for flat in pairs:
+        i, j = divmod(int(flat), m)
+        if matches[i] is not None or j in used_tracks:
             continue
-        time_gap = current_time - data['last_seen']
-        if data['is_staff'] or data['was_staff']:
-            max_time = max_time_gap_staff
-            max_dist = max_distance_staff
-        else:
-            max_time = max_time_gap_customer
-            max_dist = max_distance_customer
-        if time_gap > max_time:
-            continue
-        if data['last_position'] and data['last_box'] is not None:
-            distance = calculate_distance(current_position, data['last_position'])
-            if distance > max_dist:
-                continue
-            iou = calculate_iou(current_box, data['last_box'])
-            distance_score = max(0, 1 - (distance / max_dist))
-            combined_score = (iou * 0.7) + (distance_score * 0.3)
-            if data['is_staff'] or data['was_staff']:
-                combined_score *= 1.2
-            if combined_score > best_score:
-                best_score = combined_score
-                best_match = pid
-    threshold = 0.2 if best_match and (people_data[best_match]['is_staff'] or people_data[best_match]['was_staff']) else 0.3
-    return best_match if best_score > threshold else None
+        matches[i] = j
+        used_tracks.add(j)
+    return matches
 
 
 # ===============================
 # GROUP DETECTION
 # ===============================
-def build_groups_members_limited(centers_dict):
+def build_groups_members_limited(centers_dict, profile=DEFAULT_PROFILE):
+    """Groups (sets of ids, at least group_min_size) of people linked to their
+    group_max_neighbors nearest others within group_distance_px.
+
+    All pairwise distances are computed at once with NumPy (ties broken in
+    centers_dict order) and groups are the connected components of the links.
+    """
     ids = list(centers_dict.keys())
     if len(ids) == 0:
         return []
-    adj = {pid: [] for pid in ids}
-    for pid in ids:
-        dists = []
-        p = centers_dict[pid]
-        for other in ids:
-            if other == pid:
-                continue
-            dist = calculate_distance(p, centers_dict[other])
-            if dist <= GROUP_DISTANCE_PX:
-                dists.append((dist, other))
-        dists.sort(key=lambda x: x[0])
-        for _, other in dists[:GROUP_MAX_NEIGHBORS]:
-            adj[pid].append(other)
-            adj[other].append(pid)
-    visited = set()
-    groups = []
-    for pid in ids:
-        if pid in visited:
-            continue
-        stack = [pid]
-        comp = set([pid])
-        visited.add(pid)
-        while stack:
-            cur = stack.pop()
-            for nb in adj[cur]:
-                if nb not in visited:
-                    visited.add(nb)
-                    comp.add(nb)
-                    stack.append(nb)
-        if len(comp) >= GROUP_MIN_SIZE:
-            groups.append(comp)
-    return groups
+    if len(ids) == 1:
+        return [set(ids)] if profile.group_min_size <= 1 else []
+    centers = np.array([centers_dict[pid] for pid in ids])
+    diff = centers[:, None, :] - centers[None, :, :]
+    dists = np.sqrt(diff[..., 0] ** 2 + diff[..., 1] ** 2)
+    np.fill_diagonal(dists, np.inf)
+    k = min(profile.group_max_neighbors, len(ids) - 1)
+    nearest = np.argsort(dists, axis=1, kind='stable')[:, :k]
+    linked = np.take_along_axis(dists, nearest, axis=1) <= profile.group_distance_px
+
+    parent = list(range(len(ids)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, n in zip(*np.nonzero(linked)):
+        root_a, root_b = find(int(i)), find(int(nearest[i, n]))
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    components = {}
+    for i, pid in enumerate(ids):
+        components.setdefault(find(i), set()).add(pid)
+    return [comp for comp in components.values() if len(comp) >= profile.group_min_size]
 
 
 def group_centroid(group_set, centers_dict):
@@ -391,7 +1209,14 @@ def jaccard(a, b):
     return inter / uni if uni > 0 else 0.0
 
 
-def match_groups_to_ids(current_groups, centers_dict, group_tracks, next_group_id):
+def match_groups_to_ids(current_groups, centers_dict, group_tracks, next_group_id, profile=DEFAULT_PROFILE,
+                        time_now=None):
+    """Give each current group the id of the group track it best matches (or a
+    new id). With time_now, tracks unmatched for group_track_max_age_sec are
+    dropped first so the candidates stay few in long, crowded videos."""
+    if time_now is not None:
+        group_tracks = {gid: gt for gid, gt in group_tracks.items()
+                        if time_now - gt['last_seen'] <= profile.group_track_max_age_sec}
     pid_to_gid = {}
     current_info = []
     for g in current_groups:
@@ -405,10 +1230,10 @@ def match_groups_to_ids(current_groups, centers_dict, group_tracks, next_group_i
             if gid in used_gids:
                 continue
             dist = calculate_distance(info['centroid'], gt['centroid'])
-            if dist > GROUP_MATCH_DIST_PX:
+            if dist > profile.group_match_dist_px:
                 continue
             ov = jaccard(info['members'], gt['members'])
-            score = (ov * 1.5) + (max(0.0, 1.0 - dist / GROUP_MATCH_DIST_PX) * 0.5)
+            score = (ov * 1.5) + (max(0.0, 1.0 - dist / profile.group_match_dist_px) * 0.5)
             if score > best_score:
                 best_score = score
                 best_gid = gid
@@ -419,7 +1244,7 @@ def match_groups_to_ids(current_groups, centers_dict, group_tracks, next_group_i
         group_tracks[best_gid] = {
             'members': set(info['members']),
             'centroid': info['centroid'],
-            'last_seen': None
+            'last_seen': time_now
         }
         for pid in info['members']:
             pid_to_gid[pid] = best_gid
@@ -427,201 +1252,444 @@ def match_groups_to_ids(current_groups, centers_dict, group_tracks, next_group_i
 
 
 # ===============================
-# MAIN PROCESSING
+# PEOPLE TRACKING
 # ===============================
-def process_video(video_path, output_video, staff_zone, max_duration=None, progress_callback=None):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise ValueError(f"Cannot open video {video_path}")
-
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    max_frames = int(fps * max_duration) if max_duration else total_frames
-
-    model = YOLO(YOLO_MODEL)
-    startup_grace_frames = int(fps * STARTUP_GRACE_PERIOD_SECONDS)
-    
-    group_tracks = {}
-    next_group_id = 1
-
-    people_data = defaultdict(lambda: {
-        'first_seen': None,
-        'last_seen': None,
-        'appearances': 0,
-        'last_position': None,
-        'prev_position': None,
-        'speed': 0.0,
-        'last_box': None,
-        'frames_in_zone': 0,
-        'currently_in_zone': False,
-        'is_staff': False,
-        'was_staff': False,
-        'ever_in_zone': False,
-        'consecutive_high_coverage': 0,
-        'consecutive_low_coverage': 0,
-        'show_label': False,
-        'grace_period_active': True,
-        'classification_ready': False,
-        'staff_confirmed_at': None,
-        'activity_tracker': None,
-        'current_activity': 'initializing',
-        'group_id': None,
-        'group_size': 1,
-        'group_join_count': 0,
-        'group_leave_count': 0,
-        'group_frames_total': 0,
-    })
-
-    next_person_id = 1
-    confirmed_staff = set()
-    timeline_data = []
-
-    # Use mp4v codec (MPEG-4) - more compatible than H.264
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(
-        output_video,
-        fourcc,
-        fps,
-        (width, height)
+class PersonTrack:
+    """State of one tracked person while they are in view."""
+    __slots__ = (
+        'first_seen', 'last_seen', 'appearances', 'last_position', 'prev_position', 'speed',
+        'last_box', 'frames_in_zone', 'currently_in_zone', 'is_staff', 'was_staff',
+        'ever_in_zone', 'consecutive_high_coverage', 'consecutive_low_coverage', 'show_label',
+        'grace_period_active', 'classification_ready', 'staff_confirmed_at', 'activity_tracker',
+        'current_activity', 'group_id', 'group_size', 'group_join_count', 'group_leave_count',
+        'group_frames_total', 'det_box', 'det_frame', 'box_velocity',
     )
-    
-    if not out.isOpened():
-        raise ValueError(f"Could not create video writer for {output_video}")
-
-    frame_id = 0
-    last_time_now = 0.0
-    last_timeline_sec = -1
 
-    while True:
-        ret, frame = cap.read()
-        if not ret or frame_id >= max_frames:
-            break
+    def __init__(self, profile=DEFAULT_PROFILE):
+        self.first_seen = None
+        self.last_seen = None
+        self.appearances = 0
+        self.last_position = None
+        self.prev_position = None
+        self.speed = 0.0
+        self.last_box = None
+        self.frames_in_zone = 0
+        self.currently_in_zone = False
+        self.is_staff = False
+        self.was_staff = False
+        self.ever_in_zone = False
+        self.consecutive_high_coverage = 0
+        self.consecutive_low_coverage = 0
+        self.show_label = False
+        self.grace_period_active = True
+        self.classification_ready = False
+        self.staff_confirmed_at = None
+        self.activity_tracker = ActivityTracker(profile)
+        self.current_activity = 'initializing'
+        self.group_id = None
+        self.group_size = 1
+        self.group_join_count = 0
+        self.group_leave_count = 0
+        self.group_frames_total = 0
+        self.det_box = None
+        self.det_frame = None
+        self.box_velocity = None
+
+
+def person_exit_event(pid, d):
+    summary = d.activity_tracker.get_activity_summary(d.last_seen if d.last_seen else 0)
+    return {
+        "type": "person_exit",
+        "personId": pid,
+        "t": d.last_seen,
+        "firstSeen": d.first_seen,
+        "appearances": d.appearances,
+        "wasStaff": d.was_staff,
+        "groupId": d.group_id,
+        "groupSize": d.group_size,
+        "activeTime": summary['active']['duration'],
+        "inactiveTime": summary['inactive']['duration'],
+    }
 
-        frame_id += 1
-        time_now = frame_id / fps
-        last_time_now = time_now
-        past_startup = frame_id > startup_grace_frames
 
-        # Progress callback
-        if progress_callback and frame_id % 30 == 0:
-            progress_callback(frame_id, max_frames)
+class ResultsSummary:
+    """Final results computed from the tracker's event stream.
+
+    person_exit events carry everything a person contributes to the results,
+    so retired tracks are dropped and memory only holds the people currently
+    in view. timeline_limit keeps only the most recent timeline rows.
+    close_groups keeps only the sizes of groups closed by group_closed
+    events, and adds groupCount and groupSizes (over all groups) to the results.
+    """
+
+    def __init__(self, timeline_limit=None, close_groups=False):
+        self.staff_count = 0
+        self.customer_count = 0
+        self.total_active_time = 0.0
+        self.total_inactive_time = 0.0
+        self.groups = {}
+        self.close_groups = close_groups
+        self.closed_group_sizes = defaultdict(int)
+        self.timeline_data = deque(maxlen=timeline_limit) if timeline_limit else []
+
+    def handle(self, event):
+        if event["type"] == "timeline":
+            self.timeline_data.append({k: v for k, v in event.items() if k != "type"})
+        elif event["type"] == "person_exit":
+            self._add_person(event)
+        elif event["type"] == "group_closed":
+            info = self.groups.pop(event["groupId"], None)
+            if info:
+                self.closed_group_sizes[info['size']] += 1
+
+    def _add_person(self, event):
+        if event["wasStaff"]:
+            self.staff_count += 1
+            self.total_active_time += event["activeTime"]
+            self.total_inactive_time += event["inactiveTime"]
+        else:
+            self.customer_count += 1
+            if event["groupId"] is not None:
+                info = self.groups.setdefault(event["groupId"], {'size': 0, 'members': []})
+                info['members'].append(event["personId"])
+                info['size'] = max(info['size'], event["groupSize"])
+
+    def build(self, duration):
+        total_activity_time = self.total_active_time + self.total_inactive_time
+        active_percentage = (self.total_active_time / total_activity_time * 100) if total_activity_time > 0 else 0
+        inactive_percentage = (self.total_inactive_time / total_activity_time * 100) if total_activity_time > 0 else 0
+
+        # Build groups summary (ordered by member id, as people were created)
+        groups_summary = []
+        for gid, info in self.groups.items():
+            groups_summary.append({
+                "groupId": gid,
+                "size": info['size'],
+                "members": sorted(info['members'])
+            })
+        groups_summary.sort(key=lambda g: g['members'][0])
+
+        results = {
+            "staffCount": self.staff_count,
+            "customerCount": self.customer_count,
+            "totalPeople": self.staff_count + self.customer_count,
+            "duration": format_time_short(duration),
+            "activePercentage": round(active_percentage, 1),
+            "inactivePercentage": round(inactive_percentage, 1),
+            "timeline": list(self.timeline_data),
+            "groups": groups_summary
+        }
+        if self.close_groups:
+            sizes = defaultdict(int, self.closed_group_sizes)
+            for info in self.groups.values():
+                sizes[info['size']] += 1
+            results["groupCount"] = sum(sizes.values())
+            results["groupSizes"] = {str(size): sizes[size] for size in sorted(sizes)}
+        return results
+
+
+class PeopleTracker:
+    """Tracking, staff classification, activity and group state for one video.
+
+    update() consumes the detections of one frame (in frame order) and returns
+    a frame_info dict with everything needed to annotate that frame.
+
+    Everything the final results need is also reported as events, in order:
+    timeline (one row per second), person_enter, staff_confirmed,
+    group_formed, person_exit (with the person's totals) and end. They feed
+    self.summary and, if given, on_event.
+
+    profiler (a StageProfiler) receives the coverage, matching and grouping
+    times and the per-frame counters.
+
+    close_groups (live streams) also emits group_closed once a group's track
+    has expired and none of its members is still tracked; the summary then
+    keeps only its size, so memory does not grow with the groups ever seen.
+    """
+
+    def __init__(self, fps, width, height, profile=None, timeline_limit=None, on_event=None,
+                 profiler=None, close_groups=False):
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.profile = load_camera_profile(profile).for_frame(width, height)
+        self.staff_zone = self.profile.staff_zone
+        self.zone_mask = ZoneMask(self.staff_zone, width, height)
+        self.startup_grace_frames = int(fps * self.profile.startup_grace_period_seconds)
+
+        # Tracks of people that can still be matched (last seen within their
+        # max time gap); older ones are folded into self.summary
+        self.people_data = {}
+        self.summary = ResultsSummary(timeline_limit, close_groups)
+        self.close_groups = close_groups
+        self.on_event = on_event
+        self.profiler = profiler or StageProfiler()
+        self.next_person_id = 1
+        self.active_ids = []
+        self.group_tracks = {}
+        self.next_group_id = 1
+        self.formed_groups = set()
+        self.last_time_now = 0.0
+        self.last_timeline_sec = -1
+        # People matched on the last detected frame, extrapolated on skipped frames
+        self.carried_tracks = []
+
+    def __getstate__(self):
+        # Checkpoints keep the analysis state only: the zone mask is rebuilt
+        # from the zone, and the resumed run brings its own event sink and profiler
+        state = dict(self.__dict__)
+        del state['zone_mask'], state['on_event'], state['profiler']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.zone_mask = ZoneMask(self.staff_zone, self.width, self.height)
+        self.on_event = None
+        self.profiler = StageProfiler()
+
+    def update(self, frame_id, detections):
+        """detections=None means the frame was not run through the detector
+        (detection stride): tracks from the last detected frame are carried
+        forward by linear motion extrapolation instead."""
+        people_data = self.people_data
+        profile = self.profile
+        profiler = self.profiler
+        profiler.count("frames")
+        time_now = frame_id / self.fps
+        self.last_time_now = time_now
+        past_startup = frame_id > self.startup_grace_frames
+
+        detected = detections is not None
+        if not detected:
+            detections = self._extrapolate_tracks(frame_id)
+        matched_this_frame = []
 
-        # Draw staff zone
-        pts = np.array(staff_zone, np.int32).reshape((-1,1,2))
-        overlay = frame.copy()
-        cv2.fillPoly(overlay, [pts], COLOR_STAFF_ZONE)
-        cv2.addWeighted(overlay, 0.15, frame, 0.85, 0, frame)
-        cv2.polylines(frame, [pts], True, COLOR_STAFF_ZONE, 2)
+        current_frame_people = {}
 
-        # Detection - use fast single-scale by default
-        detections = []
-        if ENABLE_MULTI_SCALE:
-            detections.extend(detect_multi_scale(model, frame, CONF_THRESHOLD, DETECTION_SCALES))
-            detections = non_max_suppression_custom(detections, iou_threshold=0.4)
+        detections = [det for det in detections
+                      if is_valid_person_box(det['box'], self.width, self.height, profile)]
+        profiler.count("detections", len(detections))
+        start = time.perf_counter()
+        if profile.coverage_method == "area":
+            coverages = self.zone_mask.area_coverage([det['box'] for det in detections])
         else:
-            # Fast single-scale detection
-            results = model(
-                frame,
-                classes=[0],  # Only detect people
-                conf=CONF_THRESHOLD,
-                iou=IOU_THRESHOLD,
-                imgsz=IMG_SIZE,
-                verbose=False
+            coverages = self.zone_mask.coverage([det['box'] for det in detections], grid_size=10)
+        profiler.add("coverage", start)
+
+        self._retire_tracks(time_now)
+        profiler.count("activeTracks", len(self.active_ids))
+        if detected:
+            track_ids = self.active_ids
+            start = time.perf_counter()
+            matches = match_detections_to_tracks(
+                [det['box'] for det in detections],
+                [people_data[pid].last_box for pid in track_ids],
+                [people_data[pid].is_staff or people_data[pid].was_staff for pid in track_ids],
+                profile.max_distance_customer, profile.max_distance_staff
             )
-            if results[0].boxes is not None and len(results[0].boxes) > 0:
-                boxes = results[0].boxes.xyxy.cpu().numpy()
-                confs = results[0].boxes.conf.cpu().numpy()
-                for box, conf in zip(boxes, confs):
-                    detections.append({'box': box, 'conf': conf})
-
-        current_frame_people = {}
+            profiler.add("matching", start)
+            profiler.count("matchesAttempted", len(detections) * len(track_ids))
+            matched_ids = [track_ids[j] if j is not None else None for j in matches]
+            profiler.count("matches", len(matched_ids) - matched_ids.count(None))
+        else:
+            matched_ids = [det['track_id'] for det in detections]
 
-        for det in detections:
+        for det, body_coverage, matched_id in zip(detections, coverages, matched_ids):
             box = det['box']
-            if not is_valid_person_box(box, width, height):
-                continue
-
             x1, y1, x2, y2 = box
             center = ((x1+x2)/2, (y1+y2)/2)
-            body_coverage = calculate_body_coverage_in_zone(box, staff_zone, grid_size=10)
-            in_zone = body_coverage >= BODY_COVERAGE_THRESHOLD
-
-            matched_id = find_matching_person(
-                box, center, time_now, people_data,
-                MAX_DISTANCE_CUSTOMER, MAX_DISTANCE_STAFF,
-                MAX_TIME_GAP_CUSTOMER, MAX_TIME_GAP_STAFF
-            )
+            body_coverage = float(body_coverage)
+            in_zone = body_coverage >= profile.body_coverage_threshold
 
-            person_id = matched_id if matched_id else next_person_id
+            person_id = matched_id if matched_id else self.next_person_id
             if not matched_id:
-                next_person_id += 1
+                self.next_person_id += 1
+                self.active_ids.append(person_id)
+                people_data[person_id] = PersonTrack(profile)
 
             d = people_data[person_id]
 
-            if d['activity_tracker'] is None:
-                d['activity_tracker'] = ActivityTracker()
-
-            if d['first_seen'] is not None:
-                time_since_first_seen = time_now - d['first_seen']
-                if time_since_first_seen >= PERSON_GRACE_PERIOD_SECONDS:
-                    d['grace_period_active'] = False
-                    d['classification_ready'] = True
+            if d.first_seen is not None:
+                time_since_first_seen = time_now - d.first_seen
+                if time_since_first_seen >= profile.person_grace_period_seconds:
+                    d.grace_period_active = False
+                    d.classification_ready = True
 
             if in_zone:
-                d['consecutive_high_coverage'] += 1
-                d['consecutive_low_coverage'] = 0
+                d.consecutive_high_coverage += 1
+                d.consecutive_low_coverage = 0
             else:
-                d['consecutive_high_coverage'] = 0
-                d['consecutive_low_coverage'] += 1
-
-            if (d['consecutive_high_coverage'] >= STAFF_CONSISTENT_FRAMES
-                and not d['is_staff']
-                and d['classification_ready']):
-                d['is_staff'] = True
-                d['was_staff'] = True
-                d['show_label'] = True
-                d['staff_confirmed_at'] = time_now
-                confirmed_staff.add(person_id)
-
-            if d['is_staff'] and PERMANENT_STAFF_CLASSIFICATION:
+                d.consecutive_high_coverage = 0
+                d.consecutive_low_coverage += 1
+
+            if (d.consecutive_high_coverage >= profile.staff_consistent_frames
+                and not d.is_staff
+                and d.classification_ready):
+                d.is_staff = True
+                d.was_staff = True
+                d.show_label = True
+                d.staff_confirmed_at = time_now
+                self._emit({"type": "staff_confirmed", "personId": person_id, "t": time_now})
+
+            if d.is_staff and profile.permanent_staff_classification:
                 pass
-            elif d['was_staff'] and not d['is_staff'] and d['consecutive_high_coverage'] >= 3:
-                d['is_staff'] = True
-                confirmed_staff.add(person_id)
+            elif d.was_staff and not d.is_staff and d.consecutive_high_coverage >= 3:
+                d.is_staff = True
 
-            if d['is_staff'] or d['was_staff']:
-                activity_state = d['activity_tracker'].update(center, box, time_now)
-                d['current_activity'] = activity_state
+            if d.is_staff or d.was_staff:
+                activity_state = d.activity_tracker.update(center, box, time_now)
+                d.current_activity = activity_state
 
-            if not d['is_staff'] and past_startup and d['classification_ready']:
-                d['show_label'] = True
+            if not d.is_staff and past_startup and d.classification_ready:
+                d.show_label = True
 
             if in_zone:
-                d['frames_in_zone'] += 1
-                d['currently_in_zone'] = True
-                if not d['ever_in_zone']:
-                    d['ever_in_zone'] = True
+                d.frames_in_zone += 1
+                d.currently_in_zone = True
+                if not d.ever_in_zone:
+                    d.ever_in_zone = True
+            else:
+                d.currently_in_zone = False
+
+            if d.prev_position is None:
+                d.speed = 0.0
+            else:
+                d.speed = calculate_distance(center, d.prev_position)
+            d.prev_position = center
+
+            # Only real detections count toward min_appearances: a single false
+            # positive carried over a detection stride must not become a person
+            if detected:
+                d.appearances += 1
+            if d.first_seen is None:
+                d.first_seen = time_now
+            if detected and d.appearances == profile.min_appearances:
+                self._emit({"type": "person_enter", "personId": person_id, "t": time_now})
+            d.last_seen = time_now
+            d.last_position = center
+            d.last_box = box
+
+            if detected:
+                self._record_detection(d, box, frame_id)
+                matched_this_frame.append(person_id)
+
+            current_frame_people[person_id] = (box, d.is_staff, body_coverage,
+                                               d.show_label, d.grace_period_active,
+                                               d.current_activity)
+
+        if detected:
+            self.carried_tracks = matched_this_frame
+
+        start = time.perf_counter()
+        self._update_groups(current_frame_people, time_now)
+        profiler.add("grouping", start)
+
+        # Visible people and counts
+        frame_people = []
+        active_staff = 0
+        inactive_staff = 0
+        current_customers = 0
+
+        for pid, (box, is_staff, coverage, show_label, in_grace, activity) in current_frame_people.items():
+            if in_grace or not show_label:
+                continue
+            d = people_data[pid]
+
+            if is_staff:
+                if activity == "active":
+                    active_staff += 1
+                else:
+                    inactive_staff += 1
+                label = f"STAFF #{pid} | {activity.upper()}"
             else:
-                d['currently_in_zone'] = False
+                current_customers += 1
+                dur = time_now - d.first_seen if d.first_seen is not None else 0
+                if d.group_id is not None:
+                    group_txt = f"G{d.group_id} ({d.group_size})"
+                else:
+                    group_txt = "Single"
+                label = f"Customer #{pid} | {group_txt} | {format_time_short(dur)}"
+            frame_people.append((tuple(map(int, box)), is_staff, activity, label))
 
-            if d['prev_position'] is None:
-                d['speed'] = 0.0
+        # Timeline data (every second)
+        current_sec = int(time_now)
+        if current_sec > self.last_timeline_sec:
+            self.last_timeline_sec = current_sec
+            entry = {
+                "time": format_time_short(current_sec),
+                "staff": active_staff + inactive_staff,
+                "customers": current_customers,
+                "activeStaff": active_staff,
+                "inactiveStaff": inactive_staff
+            }
+            self._emit({"type": "timeline", **entry})
+            if self.close_groups:
+                self._close_groups(time_now)
+
+        return {
+            'frame': frame_id,
+            'time': time_now,
+            'people': frame_people,
+            'activeStaff': active_staff,
+            'inactiveStaff': inactive_staff,
+            'customers': current_customers,
+        }
+
+    def _retire_tracks(self, time_now):
+        active = []
+        for pid in self.active_ids:
+            d = self.people_data[pid]
+            if d.is_staff or d.was_staff:
+                max_time = self.profile.max_time_gap_staff
+            else:
+                max_time = self.profile.max_time_gap_customer
+            if time_now - d.last_seen <= max_time:
+                active.append(pid)
             else:
-                d['speed'] = calculate_distance(center, d['prev_position'])
-            d['prev_position'] = center
+                self._exit_person(pid)
+        self.active_ids = active
+
+    def _close_groups(self, time_now):
+        tracked = {d.group_id for d in self.people_data.values()}
+        for gid in [gid for gid in self.formed_groups if gid not in tracked and gid not in self.group_tracks]:
+            self.formed_groups.discard(gid)
+            self._emit({"type": "group_closed", "groupId": gid, "t": time_now})
+
+    def _exit_person(self, pid):
+        d = self.people_data.pop(pid)
+        if d.appearances >= self.profile.min_appearances:
+            self._emit(person_exit_event(pid, d))
+
+    def _emit(self, event):
+        self.summary.handle(event)
+        if self.on_event:
+            self.on_event(event)
+
+    def _record_detection(self, d, box, frame_id):
+        box = np.asarray(box, dtype=np.float32)
+        gap = frame_id - d.det_frame if d.det_frame is not None else None
+        if gap and gap <= self.fps:
+            d.box_velocity = (box - d.det_box) / gap
+        else:
+            d.box_velocity = np.zeros(4, dtype=np.float32)
+        d.det_box = box
+        d.det_frame = frame_id
 
-            d['appearances'] += 1
-            if d['first_seen'] is None:
-                d['first_seen'] = time_now
-            d['last_seen'] = time_now
-            d['last_position'] = center
-            d['last_box'] = box
+    def _extrapolate_tracks(self, frame_id):
+        detections = []
+        for pid in self.carried_tracks:
+            d = self.people_data.get(pid)
+            if d is None:
+                continue
+            box = d.det_box + d.box_velocity * (frame_id - d.det_frame)
+            box[[0, 2]] = np.clip(box[[0, 2]], 0, self.width)
+            box[[1, 3]] = np.clip(box[[1, 3]], 0, self.height)
+            detections.append({'box': box, 'conf': None, 'track_id': pid})
+        return detections
 
-            current_frame_people[person_id] = (box, d['is_staff'], body_coverage,
-                                               d['show_label'], d['grace_period_active'],
-                                               d['current_activity'])
+    def _update_groups(self, current_frame_people, time_now):
+        people_data = self.people_data
+        profile = self.profile
 
         # Group detection for customers
         customer_centers = {}
@@ -629,20 +1697,20 @@ def process_video(video_path, output_video, staff_zone, max_duration=None, progr
             if in_grace or is_staff:
                 continue
             d = people_data[pid]
-            seen_time = (time_now - d['first_seen']) if d['first_seen'] is not None else 0.0
+            seen_time = (time_now - d.first_seen) if d.first_seen is not None else 0.0
             if not show_label:
                 continue
-            if seen_time < MIN_TIME_BEFORE_GROUP_SEC:
+            if seen_time < profile.min_time_before_group_sec:
                 continue
-            if d.get('speed', 0.0) > SPEED_THRESHOLD_PX:
+            if d.speed > profile.speed_threshold_px:
                 continue
             x1, y1, x2, y2 = box
             cx, cy = (x1+x2)/2, (y1+y2)/2
             customer_centers[pid] = (cx, cy)
 
-        current_groups = build_groups_members_limited(customer_centers)
-        pid_to_gid, group_tracks, next_group_id = match_groups_to_ids(
-            current_groups, customer_centers, group_tracks, next_group_id
+        current_groups = build_groups_members_limited(customer_centers, profile)
+        pid_to_gid, self.group_tracks, self.next_group_id = match_groups_to_ids(
+            current_groups, customer_centers, self.group_tracks, self.next_group_id, profile, time_now
         )
 
         for pid, (box, is_staff, coverage, show_label, in_grace, activity) in current_frame_people.items():
@@ -654,160 +1722,1741 @@ def process_video(video_path, output_video, staff_zone, max_duration=None, progr
             in_group_now = pid in pid_to_gid
             if in_group_now:
                 gid = pid_to_gid[pid]
-                gsize = len(group_tracks[gid]['members'])
-                d['group_join_count'] += 1
-                d['group_leave_count'] = 0
-                if d['group_join_count'] >= GROUP_JOIN_FRAMES:
-                    d['group_id'] = gid
-                    d['group_size'] = gsize
-                    d['group_frames_total'] += 1
+                gsize = len(self.group_tracks[gid]['members'])
+                d.group_join_count += 1
+                d.group_leave_count = 0
+                if d.group_join_count >= profile.group_join_frames:
+                    d.group_id = gid
+                    d.group_size = gsize
+                    if gid not in self.formed_groups:
+                        self.formed_groups.add(gid)
+                        self._emit({"type": "group_formed", "groupId": gid, "size": gsize, "t": time_now})
+                    d.group_frames_total += 1
             else:
-                d['group_leave_count'] += 1
-                d['group_join_count'] = 0
-                if d['group_leave_count'] >= GROUP_LEAVE_FRAMES:
-                    d['group_id'] = None
-                    d['group_size'] = 1
-
-        # Draw people
-        visible_count = 0
-        active_staff = 0
-        inactive_staff = 0
-        current_customers = 0
+                d.group_leave_count += 1
+                d.group_join_count = 0
+                if d.group_leave_count >= profile.group_leave_frames:
+                    d.group_id = None
+                    d.group_size = 1
 
-        for pid, (box, is_staff, coverage, show_label, in_grace, activity) in current_frame_people.items():
-            if in_grace or not show_label:
+    def get_results(self):
+        for pid in self.active_ids:
+            self._exit_person(pid)
+        self.active_ids = []
+        self._emit({"type": "end", "duration": self.last_time_now})
+        return self.summary.build(self.last_time_now)
+
+
+# ===============================
+# DRAWING
+# ===============================
+class ZoneOverlay:
+    """Staff zone overlay prepared once per video.
+
+    Only the pixels inside the zone change when it is blended, so the blend
+    runs on the zone's bounding rectangle and is masked to the polygon,
+    instead of copying and blending the whole frame every frame.
+    """
+
+    def __init__(self, staff_zone, width, height, alpha=0.15):
+        self.pts = np.array(staff_zone, np.int32).reshape((-1,1,2))
+        self.alpha = alpha
+        x, y, w, h = cv2.boundingRect(self.pts)
+        self.x0, self.y0 = max(0, x), max(0, y)
+        self.x1, self.y1 = min(width, x + w), min(height, y + h)
+        roi_h = max(0, self.y1 - self.y0)
+        roi_w = max(0, self.x1 - self.x0)
+        mask = np.zeros((roi_h, roi_w), np.uint8)
+        cv2.fillPoly(mask, [self.pts - np.array([self.x0, self.y0], np.int32)], 1)
+        self.mask = mask
+        self.color = np.empty((roi_h, roi_w, 3), np.uint8)
+        self.color[:] = COLOR_STAFF_ZONE
+
+    def apply(self, frame):
+        if self.mask.size:
+            roi = frame[self.y0:self.y1, self.x0:self.x1]
+            blended = cv2.addWeighted(self.color, self.alpha, roi, 1 - self.alpha, 0)
+            cv2.copyTo(blended, self.mask, roi)
+        cv2.polylines(frame, [self.pts], True, COLOR_STAFF_ZONE, 2)
+
+
+def draw_frame(frame, frame_info, zone_overlay):
+    # Draw staff zone
+    zone_overlay.apply(frame)
+
+    # Draw people
+    for (x1, y1, x2, y2), is_staff, activity, label in frame_info['people']:
+        if is_staff:
+            activity_color = get_activity_color(activity)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), activity_color, 3)
+            cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, activity_color, 2)
+        else:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), COLOR_CUSTOMER, 2)
+            cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLOR_CUSTOMER, 2)
+
+    # Status overlay
+    active_staff = frame_info['activeStaff']
+    inactive_staff = frame_info['inactiveStaff']
+    status_msg = f"Time: {format_time_short(frame_info['time'])} | Detected: {len(frame_info['people'])}"
+    cv2.putText(frame, status_msg, (10,30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+
+    if active_staff + inactive_staff > 0:
+        activity_summary = f"Staff: Active:{active_staff} | Inactive:{inactive_staff}"
+        cv2.putText(frame, activity_summary, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+
+
+class FrameAnnotator:
+    """Draws frame infos given in width x height analysis pixels onto frames of
+    out_width x out_height (boxes and zone scaled when the sizes differ)."""
+
+    def __init__(self, staff_zone, width, height, out_width=None, out_height=None):
+        out_width, out_height = out_width or width, out_height or height
+        self.sx = out_width / width
+        self.sy = out_height / height
+        self.scaled = (out_width, out_height) != (width, height)
+        if self.scaled:
+            staff_zone = [(int(round(x * self.sx)), int(round(y * self.sy))) for x, y in staff_zone]
+        self.zone_overlay = ZoneOverlay(staff_zone, out_width, out_height)
+
+    def __call__(self, frame, frame_info):
+        if self.scaled:
+            people = [((int(x1 * self.sx), int(y1 * self.sy), int(x2 * self.sx), int(y2 * self.sy)),
+                       is_staff, activity, label)
+                      for (x1, y1, x2, y2), is_staff, activity, label in frame_info['people']]
+            frame_info = dict(frame_info, people=people)
+        draw_frame(frame, frame_info, self.zone_overlay)
+
+
+# ===============================
+# PROFILING
+# ===============================
+class StageProfiler:
+    """Wall time per processing stage and counters of one run.
+
+    Stages are timed around whole batches and tracker steps (a few
+    perf_counter calls per frame), cheap enough to always run; process_video
+    only reports them with instrument=True. Times of the threaded pipeline's
+    stages overlap, so they can add up to more than the run time. "tracking"
+    includes its "coverage", "matching" and "grouping" parts.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def add(self, stage, start):
+        """Add the time since start (a time.perf_counter() value) to stage."""
+        self.seconds[stage] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def merge(self, seconds, counters):
+        """Add the stage times and counters of another profiler (e.g. a worker's)."""
+        for stage, value in seconds.items():
+            self.seconds[stage] += value
+        for name, value in counters.items():
+            self.counters[name] += value
+
+    def progress_fields(self):
+        """Throughput so far and ms per frame of each stage (for progress messages)."""
+        elapsed = time.perf_counter() - self.started
+        frames = max(1, self.counters["frames"])
+        return {
+            "fps": round(self.counters["frames"] / elapsed, 1) if elapsed else None,
+            "stagesMs": {stage: round(seconds * 1000.0 / frames, 3) for stage, seconds in self.seconds.items()},
+        }
+
+    def report(self):
+        """The final profile block of the results."""
+        frames = max(1, self.counters["frames"])
+        return {
+            "frames": self.counters["frames"],
+            "seconds": round(time.perf_counter() - self.started, 3),
+            **self.progress_fields(),
+            "counters": dict(self.counters),
+            "perFrame": {name: round(value / frames, 2) for name, value in self.counters.items() if name != "frames"},
+        }
+
+
+def run_profiled(cprofile_path, func, *args, **kwargs):
+    """func(*args, **kwargs), under cProfile when cprofile_path is given (stats
+    dumped there in pstats format; only the calling thread is profiled)."""
+    if not cprofile_path:
+        return func(*args, **kwargs)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(cprofile_path)
+
+
+# ===============================
+# MAIN PROCESSING
+# ===============================
+def run_pipeline(source, stages, threaded=False, queue_size=PIPELINE_QUEUE_SIZE, weigh=None,
+                 max_weight=PIPELINE_MAX_BYTES):
+    """Feed every item of source through stages, in order.
+
+    With threaded=True the source and each stage run in their own thread,
+    connected by bounded queues, so decoding, inference, annotation and
+    encoding overlap (OpenCV and torch release the GIL). Each stage still
+    sees items one at a time in source order. With weigh (e.g. batch_nbytes),
+    the source waits before producing the next item while the items not yet
+    through the last stage, plus one more like the last, would weigh more
+    than max_weight; a single heavier item still goes alone.
+    """
+    if not threaded:
+        for item in source:
+            for stage in stages:
+                item = stage(item)
+        return
+
+    done = object()
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    # Weights of the items in flight, in source order (stages keep that order)
+    in_flight = deque()
+    budget = threading.Condition()
+
+    def wait_for_room(weight):
+        with budget:
+            while in_flight and sum(in_flight) + weight > max_weight and not stop.is_set():
+                budget.wait(0.1)
+
+    def release():
+        with budget:
+            in_flight.popleft()
+            budget.notify()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
                 continue
-            visible_count += 1
-            x1, y1, x2, y2 = map(int, box)
-            d = people_data[pid]
+        return False
 
-            if is_staff:
-                if activity == "active":
-                    active_staff += 1
-                else:
-                    inactive_staff += 1
-                activity_color = get_activity_color(activity)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), activity_color, 3)
-                label = f"STAFF #{pid} | {activity.upper()}"
-                cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, activity_color, 2)
-            else:
-                current_customers += 1
-                dur = time_now - d['first_seen'] if d['first_seen'] is not None else 0
-                if d.get('group_id') is not None:
-                    group_txt = f"G{d['group_id']} ({d.get('group_size', 2)})"
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return done
+
+    def produce():
+        try:
+            items = iter(source)
+            weight = 0
+            while True:
+                # The next item is built (decoded) here, so it needs room too
+                if weigh is not None:
+                    wait_for_room(weight)
+                item = next(items, done)
+                if item is done:
+                    break
+                if weigh is not None:
+                    weight = weigh(item)
+                    with budget:
+                        in_flight.append(weight)
+                if not put(queues[0], item):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(queues[0], done)
+
+    def work(stage, q_in, q_out):
+        try:
+            while True:
+                item = get(q_in)
+                if item is done:
+                    break
+                item = stage(item)
+                if q_out is None and weigh is not None:
+                    release()
+                if q_out is not None and not put(q_out, item):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if q_out is not None:
+                put(q_out, done)
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    for i, stage in enumerate(stages):
+        q_out = queues[i + 1] if i + 1 < len(queues) else None
+        threads.append(threading.Thread(target=work, args=(stage, queues[i], q_out), daemon=True))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+
+
+def open_video_capture(video_path):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return cap, fps, width, height, total_frames
+
+
+def probe_video(video_path, profile=None, max_duration=None, detect_stride=None):
+    """Video metadata and a rough processing time estimate, read with OpenCV
+    only (no model is loaded), to validate uploads and schedule jobs.
+
+    The estimate assumes the profile's fixed detection stride, so it is an
+    upper bound for adaptive stride and motion gate runs.
+    """
+    cap, fps, width, height, total_frames = open_video_capture(video_path)
+    try:
+        decodable = cap.read()[0]
+    finally:
+        cap.release()
+    if not decodable:
+        raise ValueError(f"Cannot decode video {video_path}")
+
+    profile = load_camera_profile(profile).with_overrides(detect_stride=detect_stride)
+    frames = min(total_frames, int(fps * max_duration)) if max_duration else total_frames
+    stride = max(1, int(profile.detect_stride or DETECTION_STRIDE))
+    detected_frames = -(-frames // stride)
+    return {
+        "fps": round(fps, 3),
+        "width": width,
+        "height": height,
+        "frameCount": total_frames,
+        "durationSeconds": round(total_frames / fps, 2),
+        "framesToProcess": frames,
+        "estimatedProcessingSeconds": round((detected_frames * PROBE_DETECT_MS + frames * PROBE_FRAME_MS) / 1000, 1),
+    }
+
+
+def make_detection_scheduler(profile=DEFAULT_PROFILE):
+    """Returns (scheduler or None when every frame is detected, effective stride)."""
+    detect_stride = profile.detect_stride
+    if detect_stride is None:
+        if profile.motion_gate:
+            detect_stride = MOTION_GATE_MAX_SKIP
+        else:
+            detect_stride = ADAPTIVE_MAX_STRIDE if profile.adaptive_stride else DETECTION_STRIDE
+    detect_stride = max(1, int(detect_stride))
+    if detect_stride > 1 or profile.adaptive_stride or profile.motion_gate:
+        return DetectionScheduler(detect_stride, profile.adaptive_stride, profile.motion_gate, profile), detect_stride
+    return None, detect_stride
+
+
+def resolve_profile(profile, width, height, **overrides):
+    """The run's CameraProfile: loaded (see load_camera_profile), scaled to the
+    frame size, with the explicitly given (not None) settings applied, then
+    scaled to the working resolution. Its reference_size is the size frames
+    are analyzed at (see FrameResizer)."""
+    profile = load_camera_profile(profile).for_frame(width, height).with_overrides(**overrides)
+    profile.reference_size = (width, height)
+    return profile.for_frame(*working_frame_size(width, height, profile.working_size))
+
+
+def working_frame_size(width, height, working_size=WORKING_SIZE):
+    """Analysis frame size for a width x height video: working_size is a width
+    (height keeps the aspect ratio) or (width, height); never larger than the video."""
+    if not working_size:
+        return width, height
+    if isinstance(working_size, (int, float)):
+        work_width = int(working_size)
+        work_height = int(round(height * work_width / width / 2)) * 2
+    else:
+        work_width, work_height = (int(v) for v in working_size)
+    if work_width >= width or work_height >= height:
+        return width, height
+    return work_width, work_height
+
+
+class FrameResizer:
+    """Resizes decoded frames once to the analysis size (no-op at full size)
+    with one of RESIZE_INTERPOLATIONS."""
+
+    def __init__(self, width, height, work_size, interpolation=RESIZE_INTERPOLATION):
+        if interpolation not in RESIZE_INTERPOLATIONS:
+            raise ValueError(f"Unknown resize interpolation {interpolation!r} "
+                             f"(expected one of {', '.join(RESIZE_INTERPOLATIONS)})")
+        self.size = tuple(work_size)
+        self.active = self.size != (width, height)
+        self.interpolation = RESIZE_INTERPOLATIONS[interpolation]
+
+    def __call__(self, frame):
+        if not self.active:
+            return frame
+        return cv2.resize(frame, self.size, interpolation=self.interpolation)
+
+
+def resized_batches(batches, resizer, keep_original=False, profiler=None):
+    """(frames to annotate, frames to analyze) for each decoded batch."""
+    profiler = profiler or StageProfiler()
+    batches = iter(batches)
+    while True:
+        start = time.perf_counter()
+        frames = next(batches, None)
+        if frames is None:
+            return
+        profiler.add("decode", start)
+        start = time.perf_counter()
+        work = [resizer(frame) for frame in frames]
+        profiler.add("resize", start)
+        yield (frames if keep_original else work), work
+
+
+def batch_nbytes(item):
+    """Bytes of the distinct frames in a resized_batches() item."""
+    frames, work = item
+    return sum({id(frame): frame.nbytes for frame in itertools.chain(frames, work)}.values())
+
+
+def read_frame_batches(cap, max_frames, frames_per_batch):
+    frames_read = 0
+    while frames_read < max_frames:
+        frames = []
+        while len(frames) < frames_per_batch and frames_read + len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        if not frames:
+            return
+        frames_read += len(frames)
+        yield frames
+        if len(frames) < frames_per_batch:
+            return
+
+
+def detect_scheduled(model, frames, scheduler=None, regions=None, profile=DEFAULT_PROFILE, profiler=None):
+    """Detections for every frame of a batch; None for frames the scheduler skips
+    (the tracker extrapolates those)."""
+    profiler = profiler or StageProfiler()
+    if scheduler is None:
+        start = time.perf_counter()
+        batch_detections = detect_people_batch(model, frames, regions, profile)
+        profiler.add("inference", start)
+        profiler.count("detectedFrames", len(frames))
+        return batch_detections
+
+    start = time.perf_counter()
+    selected = [scheduler.should_detect(frame) for frame in frames]
+    detected_frames = [frame for frame, sel in zip(frames, selected) if sel]
+    profiler.add("gating", start)
+    start = time.perf_counter()
+    detected = iter(detect_people_batch(model, detected_frames, regions, profile) if detected_frames else [])
+    profiler.add("inference", start)
+    profiler.count("detectedFrames", len(detected_frames))
+    batch_detections = []
+    for sel in selected:
+        if sel:
+            detections = next(detected)
+            scheduler.observe(detections)
+        else:
+            detections = scheduler.skipped_detections()
+        batch_detections.append(detections)
+    return batch_detections
+
+
+class FrameOutputs:
+    """Optional per-frame outputs of a run: annotated video and/or track log.
+
+    width/height is the analysis size (track log coordinates); output_size is
+    the size of the frames given to annotate() when they are not resized.
+    log_offset continues an existing track log from that byte position (see
+    log_position) instead of starting a new one.
+    """
+
+    def __init__(self, output_video, track_log, fps, width, height, staff_zone, output_size=None,
+                 log_offset=None):
+        self.out = None
+        self.log_file = None
+        if output_video:
+            out_width, out_height = output_size or (width, height)
+            self.out = open_video_writer(output_video, fps, out_width, out_height)
+            self.annotator = FrameAnnotator(staff_zone, width, height, out_width, out_height)
+        if track_log and log_offset is not None:
+            self.log_file = open(track_log, 'r+', encoding='utf-8')
+            self.log_file.seek(log_offset)
+            self.log_file.truncate()
+        elif track_log:
+            self.log_file = open(track_log, 'w', encoding='utf-8')
+            self.log_file.write(json.dumps({"fps": fps, "width": width, "height": height,
+                                            "staffZone": [list(p) for p in staff_zone]}) + "\n")
+
+    @property
+    def has_video(self):
+        return self.out is not None
+
+    def annotate(self, frame, frame_info):
+        if self.log_file is not None:
+            self.log_file.write(json.dumps(frame_info) + "\n")
+        if self.out is not None:
+            self.annotator(frame, frame_info)
+
+    def encode(self, frames):
+        for frame in frames:
+            self.out.write(frame)
+
+    def log_position(self):
+        """Byte length of the track log written so far (None without a log)."""
+        if self.log_file is None:
+            return None
+        self.log_file.flush()
+        return self.log_file.tell()
+
+    def close(self):
+        if self.out is not None:
+            self.out.release()
+        if self.log_file is not None:
+            self.log_file.close()
+
+
+class RunCheckpoint:
+    """Periodic snapshots of a process_video() run, so it can be resumed.
+
+    A snapshot is taken right after a batch has been tracked: the frame
+    position, the tracker (people, groups and results so far), the detection
+    scheduler as it was after that batch, the track log length and the
+    detections recorded for the cache. It is pickled to a temporary file and
+    moved over path, so a crash while writing keeps the previous snapshot.
+    Snapshots are tied to the video file and the run's settings. Runs fed
+    from the detection cache are snapshotted too; they start over if their
+    cache entry is gone when resumed.
+    """
+
+    def __init__(self, path, video_path, settings, interval=CHECKPOINT_INTERVAL_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.last_saved = time.monotonic()
+        stat = os.stat(video_path)
+        settings = dict(settings, video=[os.path.abspath(video_path), stat.st_size, stat.st_mtime])
+        self.run_key = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+    def due(self):
+        now = time.monotonic()
+        if now - self.last_saved < self.interval:
+            return False
+        self.last_saved = now
+        return True
+
+    def load(self):
+        """The saved snapshot dict, or None if there is none yet."""
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get("run") != self.run_key:
+            raise ValueError(f"Checkpoint {self.path} was written for another video or other settings")
+        return state
+
+    def save(self, **state):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(dict(state, run=self.run_key), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def process_video(video_path, output_video, profile=None, max_duration=None, progress_callback=None,
+                  model=None, batch_size=DETECTION_BATCH_SIZE, pipeline=False,
+                  detect_stride=None, adaptive_stride=None, track_log=None, event_callback=None,
+                  backend=None, rois=None, tiles=None, motion_gate=None, working_size=None,
+                  output_resolution=None, instrument=False, detection_cache=None, record_detections=None,
+                  checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL_SECONDS, resume=False):
+    """Analyze a video and return the results dict.
+
+    profile is the camera's CameraProfile (or a profile file path / settings
+    dict, see load_camera_profile); detect_stride, adaptive_stride, backend,
+    rois, tiles, motion_gate, working_size and output_resolution override its
+    settings when given (rois in this video's pixels).
+    output_video=None runs in analysis-only mode: no drawing and no video
+    encoding. track_log writes every frame's tracks as JSON lines so the
+    annotated video can be rendered later with render_video_from_log().
+    event_callback receives the tracker events (see PeopleTracker) as they happen.
+    backend selects the detector when no model is given. rois/tiles restrict
+    detection to regions of the frame (see DetectionRegions). motion_gate
+    skips detection on static frames (see DetectionScheduler). working_size
+    analyzes downscaled frames; the annotated video is written at that size or,
+    with output_resolution="original", at the video's own size.
+    instrument=True adds throughput and per-stage ms/frame to the progress
+    callback's fields and a "profile" block to the results (see StageProfiler).
+    detection_cache (a directory or DetectionCache) reuses the detections of
+    an earlier run of the same video and detector settings: without an
+    output video the video is then not even decoded. record_detections writes
+    the run's detections to a detection log for replay_detections().
+    checkpoint (a file path) snapshots the run every checkpoint_interval
+    seconds (see RunCheckpoint) and is removed once the run completes;
+    resume=True continues from it with the same results as an uninterrupted
+    run (events after the snapshot are sent again). A partly written video
+    cannot be continued, so with a checkpoint the annotated video is drawn
+    from the track log after the analysis.
+    """
+    cap, fps, width, height, total_frames = open_video_capture(video_path)
+    max_frames = int(fps * max_duration) if max_duration else total_frames
+    batch_size = max(1, int(batch_size))
+    profiler = StageProfiler()
+
+    try:
+        profile = resolve_profile(profile, width, height, detect_stride=detect_stride,
+                                  adaptive_stride=adaptive_stride, motion_gate=motion_gate,
+                                  backend=backend, rois=rois, tiles=tiles, working_size=working_size,
+                                  output_resolution=output_resolution)
+        work_width, work_height = profile.reference_size
+        regions = make_detection_regions(profile, work_width, work_height)
+        resizer = FrameResizer(width, height, profile.reference_size, profile.resize_interpolation)
+    except (OSError, ValueError):
+        cap.release()
+        raise
+    keep_original = profile.output_resolution == "original"
+    scheduler, detect_stride = make_detection_scheduler(profile)
+    # Decode enough frames per batch that about batch_size of them get detected
+    frames_per_batch = batch_size * detect_stride
+
+    checkpointer = resumed = render_video = None
+    temp_log = False
+    if checkpoint:
+        if output_video:
+            render_video, output_video = output_video, None
+            temp_log = not track_log
+            track_log = track_log or f"{checkpoint}.tracks.jsonl"
+        run_settings = {"profile": vars(profile), "maxFrames": max_frames, "batchSize": batch_size,
+                        "trackLog": track_log}
+        try:
+            checkpointer = RunCheckpoint(checkpoint, video_path, run_settings, checkpoint_interval)
+            resumed = checkpointer.load() if resume else None
+        except (OSError, ValueError, pickle.UnpicklingError):
+            cap.release()
+            raise
+
+    cached = cache_key = None
+    if detection_cache:
+        if not isinstance(detection_cache, DetectionCache):
+            detection_cache = DetectionCache(detection_cache)
+        cache_key = DetectionCache.key(video_path, profile, batch_size)
+        cached = detection_cache.load(cache_key, max_frames)
+    if resumed and resumed.get("cached") and cached is None:
+        # Snapshot of a run fed from a cache entry that has since been evicted:
+        # it holds no detection scheduler state to continue detecting from
+        print(f"Checkpoint {checkpoint} needs the evicted cache entry, starting over", file=sys.stderr)
+        resumed = None
+
+    if model is None and cached is None:
+        model = load_model(backend=profile.backend or DETECTOR_BACKEND)
+
+    if resumed:
+        tracker = resumed["tracker"]
+        tracker.on_event = event_callback
+        tracker.profiler = profiler
+        scheduler = pickle.loads(resumed["scheduler"])
+        recorded = resumed["recorded"]
+        frame_id = resumed["frame"]
+        seek_to_frame(cap, frame_id)
+    else:
+        tracker = PeopleTracker(fps, work_width, work_height, profile, on_event=event_callback,
+                                profiler=profiler)
+        recorded = []
+        frame_id = 0
+
+    try:
+        outputs = FrameOutputs(output_video, track_log, fps, work_width, work_height, profile.staff_zone,
+                               (width, height) if keep_original else None,
+                               resumed["trackLogBytes"] if resumed else None)
+    except (OSError, ValueError):
+        cap.release()
+        raise
+    keep_original = keep_original and outputs.has_video
+
+    def snapshot():
+        # Taken by the inference stage, which runs ahead of tracking when pipelined
+        if checkpointer is None or not checkpointer.due():
+            return None
+        return pickle.dumps(scheduler, protocol=pickle.HIGHEST_PROTOCOL), len(recorded)
+
+    # Stages: decode (+ resize) -> inference -> tracking + annotation -> encode
+    def infer(item):
+        frames, work = item
+        batch_detections = detect_scheduled(model, work, scheduler, regions, profile, profiler)
+        if cache_key or record_detections:
+            recorded.append(pack_detections(batch_detections))
+        return frames, batch_detections, snapshot()
+
+    if cached is not None:
+        profiler.count("cachedFrames", len(cached[0]) - frame_id)
+        cached_detections = itertools.islice(unpack_detections(*cached), frame_id, None)
+
+        def infer(item):
+            frames, work = item
+            return frames, [next(cached_detections) for _ in frames], snapshot()
+
+    def analyze(item):
+        nonlocal frame_id
+        frames, batch_detections, state = item
+        for frame, detections in zip(frames, batch_detections):
+            frame_id += 1
+
+            # Progress callback
+            if progress_callback and frame_id % 30 == 0:
+                if instrument:
+                    progress_callback(frame_id, max_frames, **profiler.progress_fields())
                 else:
-                    group_txt = "Single"
-                cv2.rectangle(frame, (x1, y1), (x2, y2), COLOR_CUSTOMER, 2)
-                cv2.putText(frame, f"Customer #{pid} | {group_txt} | {format_time_short(dur)}",
-                            (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLOR_CUSTOMER, 2)
+                    progress_callback(frame_id, max_frames)
+
+            start = time.perf_counter()
+            frame_info = tracker.update(frame_id, detections)
+            profiler.add("tracking", start)
+            start = time.perf_counter()
+            outputs.annotate(frame, frame_info)
+            profiler.add("drawing", start)
+
+        if state is not None:
+            scheduler_state, recorded_count = state
+            start = time.perf_counter()
+            checkpointer.save(frame=frame_id, tracker=tracker, scheduler=scheduler_state,
+                              recorded=recorded[:recorded_count], trackLogBytes=outputs.log_position(),
+                              cached=cached is not None)
+            profiler.add("checkpoint", start)
+        return frames
+
+    def encode(frames):
+        start = time.perf_counter()
+        outputs.encode(frames)
+        profiler.add("encode", start)
+        return frames
+
+    stages = [infer, analyze]
+    if outputs.has_video:
+        stages.append(encode)
+
+    try:
+        if cached is not None and not outputs.has_video:
+            # Nothing to draw: feed the cached detections without decoding
+            detections = list(cached_detections)
+            batches = (([None] * len(detections[i:i + frames_per_batch]), detections[i:i + frames_per_batch],
+                        snapshot())
+                       for i in range(0, len(detections), frames_per_batch))
+            stages = [analyze]
+            weigh = None
+        else:
+            batches = resized_batches(read_frame_batches(cap, max_frames - frame_id, frames_per_batch),
+                                      resizer, keep_original, profiler)
+            weigh = batch_nbytes
+        run_pipeline(batches, stages, threaded=pipeline, weigh=weigh)
+    finally:
+        cap.release()
+        outputs.close()
+
+    packed = cached if cached is not None else concat_packed(recorded)
+    if cache_key and cached is None:
+        detection_cache.store(cache_key, packed, complete=max_duration is None or frame_id < max_frames)
+    if record_detections:
+        save_detection_log(record_detections, packed, fps, work_width, work_height)
+
+    if render_video:
+        render_video_from_log(video_path, track_log, render_video, progress_callback, profile.output_resolution,
+                              profile.resize_interpolation)
+        if temp_log:
+            os.remove(track_log)
+    if checkpointer:
+        checkpointer.remove()
+
+    results = tracker.get_results()
+    if instrument:
+        results["profile"] = profiler.report()
+    return results
+
+
+def open_video_writer(output_video, fps, width, height):
+    # Use mp4v codec (MPEG-4) - more compatible than H.264
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(
+        output_video,
+        fourcc,
+        fps,
+        (width, height)
+    )
+    
+    if not out.isOpened():
+        raise ValueError(f"Could not create video writer for {output_video}")
+    return out
 
-        # Status overlay
-        status_msg = f"Time: {format_time_short(time_now)} | Detected: {visible_count}"
-        cv2.putText(frame, status_msg, (10,30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
 
-        if active_staff + inactive_staff > 0:
-            activity_summary = f"Staff: Active:{active_staff} | Inactive:{inactive_staff}"
-            cv2.putText(frame, activity_summary, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+def render_video_from_log(video_path, track_log, output_video, progress_callback=None,
+                          output_resolution=OUTPUT_RESOLUTION, resize_interpolation=RESIZE_INTERPOLATION):
+    """Draw the annotated video from a track log written by process_video(track_log=...).
 
-        out.write(frame)
+    A log analyzed at a working size is drawn on frames resized to it (with
+    resize_interpolation), or with output_resolution="original" scaled onto
+    the video's own frames.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video {video_path}")
 
-        # Timeline data (every second)
-        current_sec = int(time_now)
-        if current_sec > last_timeline_sec:
-            last_timeline_sec = current_sec
-            timeline_data.append({
-                "time": format_time_short(current_sec),
-                "staff": active_staff + inactive_staff,
-                "customers": current_customers,
-                "activeStaff": active_staff,
-                "inactiveStaff": inactive_staff
-            })
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-    cap.release()
-    out.release()
+    with open(track_log, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        work_size = (header['width'], header['height'])
+        try:
+            resizer = FrameResizer(width, height, work_size, resize_interpolation)
+        except ValueError:
+            cap.release()
+            raise
+        out_size = (width, height) if output_resolution == "original" else work_size
+        try:
+            out = open_video_writer(output_video, header['fps'], *out_size)
+        except ValueError:
+            cap.release()
+            raise
+
+        annotator = FrameAnnotator(header['staffZone'], *work_size, *out_size)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frames_written = 0
+        try:
+            for line in f:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if output_resolution != "original":
+                    frame = resizer(frame)
+                annotator(frame, json.loads(line))
+                out.write(frame)
+                frames_written += 1
+                if progress_callback and frames_written % 30 == 0:
+                    progress_callback(frames_written, total)
+        finally:
+            cap.release()
+            out.release()
+    return frames_written
+
+
+def emit(message, job_id=None):
+    if job_id is not None:
+        message = dict(message, jobId=job_id)
+    # One write per line so lines from parallel workers never interleave
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+# Job keys accepted by --serve, mapped to process_video keyword arguments
+JOB_OPTIONS = {
+    "profile": "profile",  # camera profile file path or settings object
+    "maxDuration": "max_duration",
+    "batchSize": "batch_size",
+    "pipeline": "pipeline",
+    "detectStride": "detect_stride",
+    "adaptiveStride": "adaptive_stride",
+    "motionGate": "motion_gate",
+    "trackLog": "track_log",
+    "events": "events",
+    "eventsFile": "events_file",
+    "backend": "backend",
+    "roi": "rois",
+    "tiles": "tiles",
+    "workingSize": "working_size",
+    "outputResolution": "output_resolution",
+    "instrument": "instrument",
+    "cprofile": "cprofile",
+    "detectionCache": "detection_cache",
+    "recordDetections": "record_detections",
+    "checkpoint": "checkpoint",
+    "checkpointInterval": "checkpoint_interval",
+    "resume": "resume",
+}
+
+
+class EventLog:
+    """Tracker event sink: emits {"status": "event", ...} lines and/or appends to a JSONL file."""
+
+    def __init__(self, job_id=None, stream=True, path=None):
+        self.job_id = job_id
+        self.stream = stream
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+
+    def __call__(self, event):
+        if self.file:
+            self.file.write(json.dumps(event) + "\n")
+            if event["type"] in ("timeline", "end"):
+                self.file.flush()
+        if self.stream:
+            emit({"status": "event", **event}, self.job_id)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def make_progress_callback(job_id=None):
+    def progress_callback(current, total, **fields):
+        progress = (current / total) * 100 if total else 0
+        emit({"progress": round(progress, 1), "frame": current, "total": total, **fields}, job_id)
+    return progress_callback
+
+
+def run_job(input_path, output_video, output_json, job_id=None, model=None,
+            events=False, events_file=None, cprofile=None, **options):
+    """Run one job and write its results JSON.
+
+    events=True streams tracker events while the video is processed; the
+    final complete message then leaves out the timeline (already streamed,
+    and unbounded in size) and the full results are only in output_json.
+    events_file appends the same events to a JSONL file. cprofile dumps
+    cProfile stats of the run to that path (see run_profiled).
+    """
+    event_log = EventLog(job_id, stream=events, path=events_file) if events or events_file else None
+    try:
+        results = run_profiled(
+            cprofile,
+            process_video,
+            input_path,
+            output_video,
+            progress_callback=make_progress_callback(job_id),
+            model=model,
+            event_callback=event_log,
+            **options
+        )
+    finally:
+        if event_log:
+            event_log.close()
+
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if events:
+        emit({"status": "complete", "results": {k: v for k, v in results.items() if k != "timeline"}}, job_id)
+    else:
+        emit({"status": "complete", "results": results}, job_id)
+    return results
+
+
+def serve(stream=None, backend=DETECTOR_BACKEND):
+    """Worker mode: one JSON job per line on stdin, model stays loaded between jobs.
+
+    Job line: {"jobId": ..., "input": ..., "outputVideo": ..., "outputJson": ...} plus any
+    JOB_OPTIONS key. A null/missing outputVideo runs analysis only. Each job
+    can bring its camera's profile; jobs choosing another backend (directly
+    or in their profile) load it on first use and keep it warm too.
+    Every message emitted for a job carries its jobId.
+    """
+    stream = stream or sys.stdin
+    emit({"status": "starting", "message": "Loading YOLO model..."})
+    load_model(backend=backend)
+    emit({"status": "ready"})
+
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        job_id = None
+        try:
+            job = json.loads(line)
+            job_id = job.get("jobId")
+            options = {name: job[key] for key, name in JOB_OPTIONS.items() if key in job}
+            options["profile"] = load_camera_profile(options.get("profile"))
+            options["backend"] = options.get("backend") or options["profile"].backend or backend
+            model = load_model(backend=options["backend"])
+            emit({"status": "starting", "message": "Analyzing video..."}, job_id)
+            run_job(
+                job["input"],
+                job.get("outputVideo"),
+                job["outputJson"],
+                job_id=job_id,
+                model=model,
+                **options
+            )
+        except Exception as e:
+            emit({"status": "error", "error": str(e)}, job_id)
 
-    # Separate customers and staff
-    customer_data = {}
-    staff_data = {}
 
-    for pid, d in people_data.items():
-        if d['appearances'] >= MIN_APPEARANCES:
-            if d['was_staff']:
-                staff_data[pid] = d
-            else:
-                customer_data[pid] = d
-
-    # Calculate activity summary
-    total_active_time = 0
-    total_inactive_time = 0
-    for pid, d in staff_data.items():
-        if d['activity_tracker']:
-            summary = d['activity_tracker'].get_activity_summary(d['last_seen'] if d['last_seen'] else 0)
-            total_active_time += summary['active']['duration']
-            total_inactive_time += summary['inactive']['duration']
-
-    total_activity_time = total_active_time + total_inactive_time
-    active_percentage = (total_active_time / total_activity_time * 100) if total_activity_time > 0 else 0
-    inactive_percentage = (total_inactive_time / total_activity_time * 100) if total_activity_time > 0 else 0
-
-    # Build groups summary
-    groups_summary = []
-    group_counts = defaultdict(lambda: {'size': 0, 'members': []})
-    for pid, d in customer_data.items():
-        if d.get('group_id') is not None:
-            gid = d['group_id']
-            group_counts[gid]['members'].append(pid)
-            group_counts[gid]['size'] = max(group_counts[gid]['size'], d.get('group_size', 1))
-
-    for gid, info in group_counts.items():
-        groups_summary.append({
-            "groupId": gid,
-            "size": info['size'],
-            "members": info['members']
-        })
+# ===============================
+# BATCH PROCESSING
+# ===============================
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+
+def collect_batch_inputs(items):
+    """Expand --batch items: video paths, glob patterns, directories and
+    manifests (.json list or .txt with one path per line)."""
+    inputs = []
+    for item in items:
+        lower = item.lower()
+        if lower.endswith('.json') and os.path.isfile(item):
+            with open(item, 'r', encoding='utf-8') as f:
+                paths = json.load(f)
+        elif lower.endswith('.txt') and os.path.isfile(item):
+            with open(item, 'r', encoding='utf-8') as f:
+                paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        elif os.path.isdir(item):
+            paths = sorted(os.path.join(item, name) for name in os.listdir(item)
+                           if name.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            paths = sorted(glob.glob(item)) or [item]
+        for path in paths:
+            if path not in inputs:
+                inputs.append(path)
+    return inputs
 
-    return {
-        "staffCount": len(staff_data),
-        "customerCount": len(customer_data),
-        "totalPeople": len(staff_data) + len(customer_data),
-        "duration": format_time_short(last_time_now),
-        "activePercentage": round(active_percentage, 1),
-        "inactivePercentage": round(inactive_percentage, 1),
-        "timeline": timeline_data,
-        "groups": groups_summary
+
+def _init_batch_worker(threads, backend=DETECTOR_BACKEND):
+    # Limit intra-op threads so N workers don't oversubscribe the CPU
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    cv2.setNumThreads(threads)
+    if backend == "torch":
+        import_yolo()
+        import torch
+        torch.set_num_threads(threads)
+    load_model(backend=backend, threads=threads)
+
+
+def _run_batch_job(input_path, output_video, output_json, job_id, options):
+    try:
+        results = process_video(
+            input_path,
+            output_video,
+            progress_callback=make_progress_callback(job_id),
+            **options
+        )
+        with open(output_json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        summary = {k: v for k, v in results.items() if k != 'timeline'}
+        return {"input": input_path, "outputJson": output_json, "outputVideo": output_video, **summary}
+    except Exception as e:
+        return {"input": input_path, "error": str(e)}
+
+
+def run_batch(inputs, output_dir, workers=None, threads_per_worker=None, render_video=True, **options):
+    """Analyze many videos in a process pool.
+
+    Each worker loads the model once and handles several videos. Writes one
+    results JSON (and annotated video unless render_video=False) per input
+    into output_dir, plus aggregate.json with the totals.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(inputs) or 1))
+    threads_per_worker = threads_per_worker or max(1, cpus // workers)
+
+    emit({"status": "starting", "message": f"Processing {len(inputs)} videos with {workers} workers",
+          "videos": len(inputs), "workers": workers, "threadsPerWorker": threads_per_worker})
+
+    jobs = []
+    used_names = set()
+    for input_path in inputs:
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        base, n = name, 1
+        while name in used_names:
+            n += 1
+            name = f"{base}-{n}"
+        used_names.add(name)
+        output_video = os.path.join(output_dir, f"{name}.mp4") if render_video else None
+        jobs.append((input_path, output_video, os.path.join(output_dir, f"{name}.json"), name))
+
+    options["profile"] = load_camera_profile(options.get("profile"))
+    backend = options.get("backend") or options["profile"].backend or DETECTOR_BACKEND
+
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(threads_per_worker, backend)) as pool:
+        futures = {pool.submit(_run_batch_job, input_path, output_video, output_json, name, options): name
+                   for input_path, output_video, output_json, name in jobs}
+        for future in as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            if "error" in entry:
+                emit({"status": "error", "error": entry["error"]}, futures[future])
+            else:
+                emit({"status": "complete", "outputJson": entry["outputJson"]}, futures[future])
+
+    order = {input_path: i for i, input_path in enumerate(inputs)}
+    entries.sort(key=lambda e: order[e["input"]])
+    done = [e for e in entries if "error" not in e]
+    aggregate = {
+        "videos": len(inputs),
+        "completed": len(done),
+        "failed": [{"input": e["input"], "error": e["error"]} for e in entries if "error" in e],
+        "staffCount": sum(e["staffCount"] for e in done),
+        "customerCount": sum(e["customerCount"] for e in done),
+        "totalPeople": sum(e["totalPeople"] for e in done),
+        "results": done,
     }
+    aggregate_path = os.path.join(output_dir, "aggregate.json")
+    with open(aggregate_path, 'w', encoding='utf-8') as f:
+        json.dump(aggregate, f, ensure_ascii=False, indent=2)
+
+    emit({"status": "complete", "aggregate": aggregate_path,
+          "completed": aggregate["completed"], "failed": len(aggregate["failed"])})
+    return aggregate
+
+
+# ===============================
+# CHUNKED PROCESSING
+# ===============================
+def seek_to_frame(cap, frame_index):
+    if frame_index <= 0:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != frame_index:
+        # Backend could not seek exactly: decode forward from the start instead
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        for _ in range(frame_index):
+            if not cap.grab():
+                break
+
+
+def _detect_chunk(video_path, start_frame, end_frame, batch_size, profile):
+    """Packed detections of the chunk's frames, and the worker's (stage seconds, counters)."""
+    cap, fps, width, height, total_frames = open_video_capture(video_path)
+    profiler = StageProfiler()
+    try:
+        regions = make_detection_regions(profile, *profile.reference_size)
+        resizer = FrameResizer(width, height, profile.reference_size, profile.resize_interpolation)
+        seek_to_frame(cap, start_frame)
+        scheduler, detect_stride = make_detection_scheduler(profile)
+        model = load_model(backend=profile.backend or DETECTOR_BACKEND)
+        frames_detections = []
+        batches = read_frame_batches(cap, end_frame - start_frame, batch_size * detect_stride)
+        for _, frames in resized_batches(batches, resizer, profiler=profiler):
+            frames_detections.extend(detect_scheduled(model, frames, scheduler, regions, profile, profiler))
+    finally:
+        cap.release()
+    return pack_detections(frames_detections), (dict(profiler.seconds), dict(profiler.counters))
+
+
+def process_video_chunked(video_path, output_video, profile=None, max_duration=None, progress_callback=None,
+                          workers=None, threads_per_worker=None, chunk_seconds=CHUNK_SECONDS,
+                          batch_size=DETECTION_BATCH_SIZE, detect_stride=None, adaptive_stride=None,
+                          track_log=None, event_callback=None, backend=None, rois=None, tiles=None,
+                          motion_gate=None, working_size=None, output_resolution=None, instrument=False,
+                          record_detections=None):
+    """Analyze one long video by detecting on time chunks in parallel workers.
+
+    Each worker seeks to its chunk and only runs detection (the expensive
+    part), returning compact per-frame detections. Tracking, staff
+    classification, groups and the timeline then run once over all chunks in
+    frame order, so tracks continue across chunk boundaries exactly as in a
+    single pass. Only the detection stride restarts at each chunk. profile,
+    the overrides, instrument and record_detections are as in process_video;
+    the workers' decode and inference times are added up in the profile.
+    """
+    cap, fps, width, height, total_frames = open_video_capture(video_path)
+    max_frames = min(int(fps * max_duration), total_frames) if max_duration else total_frames
+    if max_frames <= 0:
+        cap.release()
+        raise ValueError(f"Cannot split {video_path} into chunks: unknown frame count")
+    try:
+        profile = resolve_profile(profile, width, height, detect_stride=detect_stride,
+                                  adaptive_stride=adaptive_stride, motion_gate=motion_gate,
+                                  backend=backend, rois=rois, tiles=tiles, working_size=working_size,
+                                  output_resolution=output_resolution)
+        resizer = FrameResizer(width, height, profile.reference_size, profile.resize_interpolation)
+    except (OSError, ValueError):
+        cap.release()
+        raise
+    work_width, work_height = profile.reference_size
+    keep_original = profile.output_resolution == "original"
+
+    chunk_frames = max(1, int(fps * chunk_seconds))
+    ranges = [(start, min(start + chunk_frames, max_frames)) for start in range(0, max_frames, chunk_frames)]
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(ranges)))
+    threads_per_worker = threads_per_worker or max(1, cpus // workers)
+    batch_size = max(1, int(batch_size))
+
+    profiler = StageProfiler()
+    tracker = PeopleTracker(fps, work_width, work_height, profile, on_event=event_callback, profiler=profiler)
+    try:
+        outputs = FrameOutputs(output_video, track_log, fps, work_width, work_height, profile.staff_zone,
+                               (width, height) if keep_original else None)
+    except ValueError:
+        cap.release()
+        raise
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                               initargs=(threads_per_worker, profile.backend or DETECTOR_BACKEND))
+    try:
+        futures = [pool.submit(_detect_chunk, video_path, start, end, batch_size, profile)
+                   for start, end in ranges]
+        frame_id = 0
+        recorded = []
+        for future in futures:
+            start = time.perf_counter()
+            packed, (seconds, counters) = future.result()
+            profiler.add("chunkWait", start)
+            profiler.merge(seconds, counters)
+            recorded.append(packed)
+            for detections in unpack_detections(*packed):
+                frame_id += 1
+
+                # Progress callback
+                if progress_callback and frame_id % 30 == 0:
+                    if instrument:
+                        progress_callback(frame_id, max_frames, **profiler.progress_fields())
+                    else:
+                        progress_callback(frame_id, max_frames)
+
+                start = time.perf_counter()
+                frame_info = tracker.update(frame_id, detections)
+                profiler.add("tracking", start)
+                frame = None
+                if outputs.has_video:
+                    start = time.perf_counter()
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    if not keep_original:
+                        frame = resizer(frame)
+                    profiler.add("decode", start)
+                start = time.perf_counter()
+                outputs.annotate(frame, frame_info)
+                profiler.add("drawing", start)
+                if frame is not None:
+                    start = time.perf_counter()
+                    outputs.encode([frame])
+                    profiler.add("encode", start)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        cap.release()
+        outputs.close()
+
+    if record_detections:
+        save_detection_log(record_detections, concat_packed(recorded), fps, work_width, work_height)
+
+    results = tracker.get_results()
+    if instrument:
+        results["profile"] = profiler.report()
+    return results
+
+
+# ===============================
+# REPLAY
+# ===============================
+def replay_detections(detection_log, profile=None, max_duration=None, event_callback=None, instrument=False):
+    """Results of a recorded detection log (process_video(record_detections=...))
+    under another profile: only tracking, staff classification, activity and
+    groups run, no decoding or inference. The profile's detector settings
+    (thresholds, stride, ROIs, ...) have no effect here; they were fixed when
+    the log was recorded.
+    """
+    packed, fps, width, height = load_detection_log(detection_log)
+    max_frames = int(fps * max_duration) if max_duration else None
+    profiler = StageProfiler()
+    tracker = PeopleTracker(fps, width, height, profile, on_event=event_callback, profiler=profiler)
+    for frame_id, detections in enumerate(unpack_detections(*packed), 1):
+        if max_frames and frame_id > max_frames:
+            break
+        start = time.perf_counter()
+        tracker.update(frame_id, detections)
+        profiler.add("tracking", start)
+    results = tracker.get_results()
+    if instrument:
+        results["profile"] = profiler.report()
+    return results
+
+
+def expand_grid(grid):
+    """Every combination of a {setting: [values, ...]} grid, as settings dicts."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _replay_grid_point(detection_log, profile, settings, max_duration):
+    point = CameraProfile(**vars(profile)).update({profile_setting_name(k): v for k, v in settings.items()})
+    results = replay_detections(detection_log, point, max_duration)
+    return {"settings": settings, "results": {k: v for k, v in results.items() if k != "timeline"}}
+
+
+def sweep_replay(detection_log, grid, profile=None, max_duration=None, workers=None):
+    """Replay a detection log once per combination of grid (a {setting:
+    [values]} dict, camelCase or snake_case, values in the profile's
+    reference pixels) in parallel processes. Returns one {"settings",
+    "results"} entry per combination, in grid order, without timelines.
+    """
+    profile = load_camera_profile(profile)
+    points = expand_grid(grid)
+    # Unknown setting names fail here, before any work is sent out
+    for name in grid:
+        if profile_setting_name(name) not in PROFILE_SETTINGS:
+            raise ValueError(f"Unknown camera profile setting {name!r}")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(points) or 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_replay_grid_point, detection_log, profile, settings, max_duration)
+                   for settings in points]
+        return [future.result() for future in futures]
+
+
+# ===============================
+# LIVE STREAM PROCESSING
+# ===============================
+class LatestFrameReader:
+    """Reads a camera/stream in a background thread, keeping only the newest frame.
+
+    The consumer always gets the most recent frame, so when analysis is slower
+    than the stream, the frames in between are dropped instead of queueing up.
+    realtime=True paces a local file at its own fps so it behaves like a camera.
+    """
+
+    def __init__(self, source, realtime=False):
+        self.source = source
+        self.realtime = realtime
+        self.cap, self.fps, self.width, self.height, _ = open_video_capture(source)
+        self.cond = threading.Condition()
+        self.latest = None
+        self.frames_read = 0
+        self.finished = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _reconnect(self):
+        if "://" not in str(self.source):
+            return False
+        for _ in range(LIVE_RECONNECT_ATTEMPTS):
+            if self.stopped:
+                return False
+            outage_start = time.monotonic()
+            time.sleep(1.0)
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.source)
+            if self.cap.isOpened():
+                # Keep frame numbers in stream time across the outage
+                self.frames_read += int((time.monotonic() - outage_start) * self.fps)
+                return True
+        return False
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        next_time = time.monotonic()
+        while not self.stopped:
+            ret, frame = self.cap.read()
+            if not ret:
+                if self._reconnect():
+                    continue
+                break
+            self.frames_read += 1
+            with self.cond:
+                self.latest = (self.frames_read, frame, time.monotonic())
+                self.cond.notify_all()
+            if self.realtime:
+                next_time += interval
+                time.sleep(max(0.0, next_time - time.monotonic()))
+        self.cap.release()
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def get(self, after_index, timeout=0.5):
+        """Newest (index, frame, read_time) after after_index; None on timeout or
+        when the stream has ended."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.finished or (self.latest and self.latest[0] > after_index),
+                               timeout=timeout)
+            if self.latest and self.latest[0] > after_index:
+                return self.latest
+            return None
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join(timeout=2.0)
+
+
+def process_stream(source, profile=None, max_duration=None, model=None, realtime=False,
+                   detect_stride=None, adaptive_stride=None, update_callback=None, stop_event=None,
+                   backend=None, rois=None, tiles=None, motion_gate=None, working_size=None,
+                   instrument=False):
+    """Live analysis of a camera/stream URL (or a local file for testing).
+
+    Frames are analyzed as they arrive with bounded latency: when analysis
+    falls behind, the frames in between are dropped and only tracked by
+    extrapolation (like a detection stride). update_callback receives one
+    dict per second of stream time with that second's timeline row, the
+    current counts, latency and dropped frames. Memory is bounded: old
+    tracks are retired, groups whose members have all left are reduced to
+    their size (see PeopleTracker close_groups) and only the last
+    LIVE_TIMELINE_KEEP timeline rows are kept for the final results. profile, the overrides and instrument
+    are as in process_video (the stage times go into every update).
+    """
+    reader = LatestFrameReader(source, realtime)
+    fps = reader.fps
+    try:
+        profile = resolve_profile(profile, reader.width, reader.height, detect_stride=detect_stride,
+                                  adaptive_stride=adaptive_stride, motion_gate=motion_gate,
+                                  backend=backend, rois=rois, tiles=tiles, working_size=working_size)
+        regions = make_detection_regions(profile, *profile.reference_size)
+        resizer = FrameResizer(reader.width, reader.height, profile.reference_size,
+                               profile.resize_interpolation)
+    except (OSError, ValueError):
+        reader.stop()
+        raise
+    max_frames = int(fps * max_duration) if max_duration else None
+    scheduler, detect_stride = make_detection_scheduler(profile)
+    if model is None:
+        model = load_model(backend=profile.backend or DETECTOR_BACKEND)
+
+    state = {'dropped': 0, 'latency': 0.0, 'frame': 0}
+    profiler = StageProfiler()
+
+    def on_event(event):
+        if update_callback and event["type"] == "timeline":
+            update = {k: v for k, v in event.items() if k != "type"}
+            if instrument:
+                update.update(profiler.progress_fields())
+            update_callback(dict(update, frame=state['frame'], latency=round(state['latency'], 3),
+                                 droppedFrames=state['dropped']))
+
+    tracker = PeopleTracker(fps, *profile.reference_size, profile,
+                            timeline_limit=LIVE_TIMELINE_KEEP, on_event=on_event, profiler=profiler,
+                            close_groups=True)
+
+    last_index = 0
+    try:
+        while not (stop_event is not None and stop_event.is_set()):
+            item = reader.get(last_index)
+            if item is None:
+                if reader.finished:
+                    break
+                continue
+            index, frame, read_time = item
+            if max_frames and index > max_frames:
+                break
+
+            # Frames dropped while we were busy are tracked by extrapolation
+            for skipped in range(last_index + 1, index):
+                state['dropped'] += 1
+                state['frame'] = skipped
+                tracker.update(skipped, None)
+
+            start = time.perf_counter()
+            frame = resizer(frame)
+            profiler.add("resize", start)
+            detections = detect_scheduled(model, [frame], scheduler, regions, profile, profiler)[0]
+            state['frame'] = index
+            state['latency'] = time.monotonic() - read_time
+            start = time.perf_counter()
+            tracker.update(index, detections)
+            profiler.add("tracking", start)
+            last_index = index
+    finally:
+        reader.stop()
+
+    results = tracker.get_results()
+    results["droppedFrames"] = state['dropped']
+    if instrument:
+        results["profile"] = profiler.report()
+    return results
+
+
+def parse_roi(text):
+    values = [float(v) for v in text.split(",")]
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("expected x1,y1,x2,y2")
+    return tuple(values)
+
+
+def parse_tiles(text):
+    cols, _, rows = text.lower().partition("x")
+    try:
+        return int(cols), int(rows or cols)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected COLSxROWS, e.g. 2x2")
+
+
+def parse_working_size(text):
+    width, _, height = text.lower().partition("x")
+    try:
+        return (int(width), int(height)) if height else int(width)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTH or WIDTHxHEIGHT, e.g. 960 or 960x540")
 
 
 def main():
     parser = argparse.ArgumentParser(description="MKMN Video Analyzer - YOLOv8 Staff/Customer Detection")
-    parser.add_argument("--input", required=True, help="Input video path")
-    parser.add_argument("--output-video", required=True, help="Output annotated video path")
-    parser.add_argument("--output-json", required=True, help="Output JSON results path")
+    parser.add_argument("--input", help="Input video path")
+    parser.add_argument("--output-video", help="Output annotated video path")
+    parser.add_argument("--output-json", help="Output JSON results path")
     parser.add_argument("--max-duration", type=float, default=None, help="Max video duration in seconds")
+    parser.add_argument("--batch-size", type=int, default=DETECTION_BATCH_SIZE,
+                        help="Frames per YOLO inference call")
+    parser.add_argument("--profile", help="Camera profile JSON: staff zone, thresholds, stride, backend, ROIs")
+    parser.add_argument("--backend", choices=DETECTOR_BACKENDS, default=None,
+                        help="Detector backend: PyTorch, or the ONNX export on onnxruntime/OpenVINO "
+                             f"(optionally INT8); default from --profile, else {DETECTOR_BACKEND}")
+    parser.add_argument("--probe", action="store_true",
+                        help="Print --input's fps, size, frame count and estimated processing time, then exit")
+    parser.add_argument("--check-backend", action="store_true",
+                        help="Compare --backend against the PyTorch detector on the first frames of --input")
+    parser.add_argument("--roi", type=parse_roi, action="append", metavar="X1,Y1,X2,Y2",
+                        help="Only detect people inside this frame rectangle (repeatable)")
+    parser.add_argument("--tiles", type=parse_tiles, metavar="COLSxROWS",
+                        help="Split each ROI (or the full frame) into overlapping tiles for detection")
+    parser.add_argument("--working-size", type=parse_working_size, metavar="WIDTH[xHEIGHT]",
+                        help="Downscale frames to this size once after decoding and analyze them there")
+    parser.add_argument("--output-resolution", choices=("working", "original"), default=None,
+                        help="Annotated video at the working size (default) or the input's own size")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap decode, inference, annotation and encode in separate threads")
+    parser.add_argument("--detect-stride", type=int, default=None,
+                        help="Run detection on every k-th frame and extrapolate tracks in between "
+                             f"(max stride in adaptive mode, default {ADAPTIVE_MAX_STRIDE})")
+    parser.add_argument("--adaptive-stride", action="store_true", default=None,
+                        help="Detect more often when the scene or people move fast")
+    parser.add_argument("--motion-gate", action="store_true", default=None,
+                        help="Skip detection on static frames and reuse the last detections "
+                             f"(at most --detect-stride frames in a row, default {MOTION_GATE_MAX_SKIP})")
+    parser.add_argument("--no-video", action="store_true",
+                        help="Analysis only: skip drawing and the annotated output video")
+    parser.add_argument("--track-log", help="Write per-frame tracks (JSON lines) for rendering later")
+    parser.add_argument("--events", action="store_true",
+                        help="Stream tracker events (timeline, enter/exit, staff, groups) while analyzing")
+    parser.add_argument("--events-file", help="Append tracker events as JSON lines to this file")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Per-stage timings and counters in progress messages and a results \"profile\" block")
+    parser.add_argument("--cprofile", metavar="PATH",
+                        help="Dump cProfile stats of the run to PATH (main thread only; pstats format)")
+    parser.add_argument("--detection-cache", metavar="DIR",
+                        help="Cache raw detections here and reuse them when the same video is re-analyzed "
+                             "with the same detector settings (other zone/tracking/group settings are fine)")
+    parser.add_argument("--record-detections", metavar="PATH",
+                        help="Also save the run's detections as a detection log (.npz) for --replay")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="Save the run's state to this file periodically so it can be resumed")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL_SECONDS,
+                        metavar="SECONDS", help="Seconds between checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from --checkpoint if it exists (same results as one uninterrupted run)")
+    parser.add_argument("--replay", metavar="DETECTION_LOG",
+                        help="Re-run tracking and analytics from a detection log with --profile, no video")
+    parser.add_argument("--sweep", metavar="GRID",
+                        help="With --replay: JSON object (or file) of setting -> list of values; "
+                             "replays every combination in parallel --workers")
+    parser.add_argument("--render-from-log", metavar="TRACK_LOG",
+                        help="Render --output-video for --input from a saved track log, no analysis")
+    parser.add_argument("--batch", nargs="+", metavar="VIDEOS",
+                        help="Analyze many videos in parallel: paths, globs, directories or "
+                             "manifests (.json list / .txt lines); results go to --output-dir")
+    parser.add_argument("--output-dir", help="Output directory for --batch")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --batch")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Torch/OpenCV threads per --batch worker (default: CPUs / workers)")
+    parser.add_argument("--parallel-chunks", action="store_true",
+                        help="Split --input into time chunks detected in parallel by --workers")
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS,
+                        help="Chunk length for --parallel-chunks")
+    parser.add_argument("--live", metavar="URL",
+                        help="Analyze a camera/stream URL live, emitting counts every second")
+    parser.add_argument("--realtime", action="store_true",
+                        help="With --live on a local file: read it at its own fps like a camera")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as a persistent worker reading JSON jobs from stdin (one per line)")
     args = parser.parse_args()
 
-    def progress_callback(current, total):
-        progress = (current / total) * 100
-        print(json.dumps({"progress": round(progress, 1), "frame": current, "total": total}), flush=True)
+    if args.serve:
+        serve(backend=args.backend or DETECTOR_BACKEND)
+        return
+
+    if args.probe:
+        if not args.input:
+            parser.error("--probe needs --input")
+        try:
+            emit({"status": "complete",
+                  "probe": probe_video(args.input, args.profile, args.max_duration, args.detect_stride)})
+        except Exception as e:
+            emit({"status": "error", "error": str(e)})
+            sys.exit(1)
+        return
+
+    if args.check_backend:
+        if not args.input:
+            parser.error("--check-backend needs --input")
+        try:
+            backend = args.backend or load_camera_profile(args.profile).backend or DETECTOR_BACKEND
+            report = compare_backends(args.input, backend)
+            emit({"status": "complete", "check": report})
+        except Exception as e:
+            emit({"status": "error", "error": str(e)})
+            sys.exit(1)
+        if not report["ok"]:
+            sys.exit(1)
+        return
+
+    if args.live:
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+        try:
+            emit({"status": "starting", "message": "Loading YOLO model..."})
+            results = process_stream(
+                args.live,
+                args.profile,
+                max_duration=args.max_duration,
+                realtime=args.realtime,
+                detect_stride=args.detect_stride,
+                adaptive_stride=args.adaptive_stride,
+                update_callback=lambda update: emit({"status": "live", **update}),
+                stop_event=stop_event,
+                backend=args.backend,
+                rois=args.roi,
+                tiles=args.tiles,
+                motion_gate=args.motion_gate,
+                working_size=args.working_size,
+                instrument=args.instrument
+            )
+            if args.output_json:
+                with open(args.output_json, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2)
+            emit({"status": "complete", "results": results})
+        except Exception as e:
+            emit({"status": "error", "error": str(e)})
+            sys.exit(1)
+        return
+
+    if args.batch:
+        if not args.output_dir:
+            parser.error("--batch needs --output-dir")
+        inputs = collect_batch_inputs(args.batch)
+        if not inputs:
+            parser.error("--batch matched no videos")
+        run_batch(inputs, args.output_dir, args.workers, args.threads_per_worker,
+                  render_video=not args.no_video, profile=args.profile,
+                  max_duration=args.max_duration, batch_size=args.batch_size, pipeline=args.pipeline,
+                  detect_stride=args.detect_stride, adaptive_stride=args.adaptive_stride,
+                  backend=args.backend, rois=args.roi, tiles=args.tiles, motion_gate=args.motion_gate,
+                  working_size=args.working_size, output_resolution=args.output_resolution,
+                  instrument=args.instrument, detection_cache=args.detection_cache)
+        return
+
+    if args.replay:
+        if not args.output_json:
+            parser.error("--replay needs --output-json")
+        try:
+            if args.sweep:
+                grid_source = args.sweep
+                if os.path.exists(grid_source):
+                    with open(grid_source, 'r', encoding='utf-8') as f:
+                        grid_source = f.read()
+                runs = sweep_replay(args.replay, json.loads(grid_source), args.profile,
+                                    args.max_duration, args.workers)
+                with open(args.output_json, 'w', encoding='utf-8') as f:
+                    json.dump({"runs": runs}, f, ensure_ascii=False, indent=2)
+                emit({"status": "complete", "runs": len(runs), "outputJson": args.output_json})
+            else:
+                event_log = EventLog(stream=args.events, path=args.events_file) \
+                    if args.events or args.events_file else None
+                try:
+                    results = replay_detections(args.replay, args.profile, args.max_duration,
+                                                event_log, args.instrument)
+                finally:
+                    if event_log:
+                        event_log.close()
+                with open(args.output_json, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2)
+                if args.events:
+                    results = {k: v for k, v in results.items() if k != "timeline"}
+                emit({"status": "complete", "results": results})
+        except Exception as e:
+            emit({"status": "error", "error": str(e)})
+            sys.exit(1)
+        return
+
+    if args.render_from_log:
+        if not (args.input and args.output_video):
+            parser.error("--render-from-log needs --input and --output-video")
+        try:
+            profile = load_camera_profile(args.profile)
+            render_video_from_log(args.input, args.render_from_log, args.output_video,
+                                  make_progress_callback(), args.output_resolution or profile.output_resolution,
+                                  profile.resize_interpolation)
+            emit({"status": "complete", "outputVideo": args.output_video})
+        except Exception as e:
+            emit({"status": "error", "error": str(e)})
+            sys.exit(1)
+        return
+
+    if not (args.input and args.output_json and (args.output_video or args.no_video)):
+        parser.error("--input, --output-json and --output-video (or --no-video) are required (unless --serve)")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint")
+
+    options = {
+        "profile": args.profile,
+        "max_duration": args.max_duration,
+        "batch_size": args.batch_size,
+        "pipeline": args.pipeline,
+        "detect_stride": args.detect_stride,
+        "adaptive_stride": args.adaptive_stride,
+        "track_log": args.track_log,
+        "backend": args.backend,
+        "rois": args.roi,
+        "tiles": args.tiles,
+        "motion_gate": args.motion_gate,
+        "working_size": args.working_size,
+        "output_resolution": args.output_resolution,
+        "instrument": args.instrument,
+        "detection_cache": args.detection_cache,
+        "record_detections": args.record_detections,
+        "checkpoint": args.checkpoint,
+        "checkpoint_interval": args.checkpoint_interval,
+        "resume": args.resume,
+    }
 
     try:
-        print(json.dumps({"status": "starting", "message": "Loading YOLO model..."}), flush=True)
-        
-        results = process_video(
-            args.input,
-            args.output_video,
-            STAFF_ZONE,
-            args.max_duration,
-            progress_callback
-        )
-
-        with open(args.output_json, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-
-        print(json.dumps({"status": "complete", "results": results}), flush=True)
+        emit({"status": "starting", "message": "Loading YOLO model..."})
+        if args.parallel_chunks:
+            options.pop("pipeline")
+            # Chunks restart the detection stride, so their detections are not cached
+            options.pop("detection_cache")
+            # Chunk workers hold no resumable state
+            for name in ("checkpoint", "checkpoint_interval", "resume"):
+                options.pop(name)
+            event_log = EventLog(stream=args.events, path=args.events_file) \
+                if args.events or args.events_file else None
+            try:
+                results = run_profiled(
+                    args.cprofile,
+                    process_video_chunked,
+                    args.input,
+                    None if args.no_video else args.output_video,
+                    progress_callback=make_progress_callback(),
+                    workers=args.workers,
+                    threads_per_worker=args.threads_per_worker,
+                    chunk_seconds=args.chunk_seconds,
+                    event_callback=event_log,
+                    **options
+                )
+            finally:
+                if event_log:
+                    event_log.close()
+            with open(args.output_json, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            if args.events:
+                results = {k: v for k, v in results.items() if k != "timeline"}
+            emit({"status": "complete", "results": results})
+        else:
+            run_job(args.input, None if args.no_video else args.output_video, args.output_json,
+                    events=args.events, events_file=args.events_file, cprofile=args.cprofile, **options)
 
     except Exception as e:
-        print(json.dumps({"status": "error", "error": str(e)}), flush=True)
+        emit({"status": "error", "error": str(e)})
         sys.exit(1)
 
 
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MKMN Video Analyzer - Benchmark
+Runs the analyzer on synthetic footage with a stub detector (no model weights
+needed) and reports throughput, per-stage latency (the analyzer's own
+instrumentation), peak memory and how they scale with crowd size, plus the
+analyzer's import and --probe time.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import video_analyzer as va
+
+# ===============================
+# CONFIGURATION
+# ===============================
+BENCH_PEOPLE = [5, 20, 50]
+BENCH_RESOLUTIONS = [(640, 480)]
+BENCH_SECONDS = 10
+BENCH_FPS = 15
+BENCH_SEED = 0
+
+# Synthetic people, relative to the frame size
+PERSON_WIDTH = 0.045
+PERSON_HEIGHT = 0.16
+WALK_SPEED = 0.06            # frame widths per second
+STANDING_SHARE = 0.3         # people who mostly stand still (staff-like)
+PERSON_GRAY = 240            # people are bright, the background is dark
+STUB_THRESHOLD = 200
+
+# Fps drop (share of the baseline) reported as a regression by --baseline
+REGRESSION_TOLERANCE = 0.15
+
+# Startup: fresh-interpreter imports timed (best of), and the detector
+# dependencies that importing the analyzer must not load
+IMPORT_RUNS = 3
+HEAVY_MODULES = ("torch", "ultralytics", "onnxruntime", "openvino")
+
+
+# ===============================
+# SYNTHETIC FOOTAGE
+# ===============================
+class SyntheticScene:
+    """People entering, walking, pausing and leaving over a static background.
+
+    Sizes and speeds are relative to the frame, so every resolution shows the
+    same scene. boxes() is the exact detection stream, render() the frame.
+    """
+
+    def __init__(self, people, width, height, fps=BENCH_FPS, seconds=BENCH_SECONDS, seed=BENCH_SEED):
+        rng = np.random.default_rng(seed)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = int(seconds * fps)
+        self.box_w = max(20, int(width * PERSON_WIDTH))
+        self.box_h = max(40, int(height * PERSON_HEIGHT))
+
+        noise = rng.integers(30, 90, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+        self.background = cv2.resize(noise, (width, height), interpolation=cv2.INTER_LINEAR)
+        self.paths = [self._walk(rng) for _ in range(people)]
+
+    def _walk(self, rng):
+        """(frames, 2) box centers of one person, NaN while they are not in view."""
+        low = np.array([self.box_w / 2, self.box_h / 2])
+        high = np.array([self.width - self.box_w / 2, self.height - self.box_h / 2])
+        path = np.full((self.frames, 2), np.nan)
+        enter = 0 if rng.random() < 0.5 else int(rng.integers(0, max(1, self.frames // 2)))
+        leave = self.frames if rng.random() < 0.7 else int(rng.integers(enter + 1, self.frames + 1))
+        standing = rng.random() < STANDING_SHARE
+        speed = WALK_SPEED * self.width / self.fps * rng.uniform(0.5, 1.5)
+
+        position = rng.uniform(low, high)
+        target = position
+        pause = 0
+        for i in range(enter, leave):
+            if pause > 0:
+                pause -= 1
+                if standing:
+                    position = np.clip(position + rng.normal(0, 0.5, 2), low, high)
+            else:
+                step = target - position
+                distance = np.hypot(*step)
+                if distance <= speed:
+                    position = target
+                    target = rng.uniform(low, high)
+                    pause = int(rng.integers(self.fps * 10, self.fps * 30)) if standing \
+                        else int(rng.integers(0, self.fps * 4))
+                else:
+                    position = position + step * (speed / distance)
+            path[i] = position
+        return path
+
+    def boxes(self, index):
+        centers = np.array([path[index] for path in self.paths]).reshape(-1, 2)
+        centers = centers[~np.isnan(centers[:, 0])]
+        half = np.array([self.box_w / 2, self.box_h / 2])
+        return np.hstack([centers - half, centers + half]).astype(np.float32)
+
+    def render(self, index):
+        frame = self.background.copy()
+        for x1, y1, x2, y2 in self.boxes(index).astype(int):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (PERSON_GRAY,) * 3, -1)
+        return frame
+
+    def write_video(self, path):
+        out = va.open_video_writer(path, self.fps, self.width, self.height)
+        try:
+            for i in range(self.frames):
+                out.write(self.render(i))
+        finally:
+            out.release()
+        return path
+
+
+class StubDetector:
+    """Stand-in for the YOLO model: finds the bright synthetic people by
+    thresholding. infer_ms sleeps per frame to mimic a real model's cost."""
+
+    def __init__(self, infer_ms=0.0):
+        self.infer_ms = infer_ms
+
+    def detect(self, frames, conf_threshold, iou_threshold):
+        if self.infer_ms:
+            time.sleep(self.infer_ms * len(frames) / 1000.0)
+        results = []
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            _, mask = cv2.threshold(gray, STUB_THRESHOLD, 255, cv2.THRESH_BINARY)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            x, y, w, h = stats[1:, :4].T
+            boxes = np.stack([x, y, x + w, y + h], axis=1).astype(np.float32)
+            results.append((boxes, np.full(len(boxes), 0.9, np.float32)))
+        return results
+
+
+# ===============================
+# MEASUREMENT
+# ===============================
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def run_scenario(scenario):
+    """One benchmark run (in a fresh process, so peak RSS is its own)."""
+    if scenario["mode"] == "tracker":
+        scene = SyntheticScene(scenario["people"], *scenario["resolution"], scenario["fps"],
+                               scenario["seconds"], scenario["seed"])
+        stream = [[{'box': box, 'conf': 0.9} for box in scene.boxes(i)] for i in range(scene.frames)]
+        profiler = va.StageProfiler()
+        tracker = va.PeopleTracker(scene.fps, scene.width, scene.height, profiler=profiler)
+        for i, detections in enumerate(stream):
+            start = time.perf_counter()
+            tracker.update(i + 1, detections)
+            profiler.add("tracking", start)
+        results = tracker.get_results()
+        results["profile"] = profiler.report()
+    else:
+        output_video = None
+        if scenario["render"]:
+            output_video = os.path.join(os.path.dirname(scenario["video"]), f"out-{os.getpid()}.mp4")
+        results = va.process_video(scenario["video"], output_video, model=StubDetector(scenario["infer_ms"]),
+                                   instrument=True, **scenario["options"])
+        if output_video and os.path.exists(output_video):
+            os.remove(output_video)
+
+    profile = results["profile"]
+    return {
+        "frames": profile["frames"],
+        "seconds": profile["seconds"],
+        "fps": profile["fps"],
+        "stagesMs": profile["stagesMs"],
+        "perFrame": profile["perFrame"],
+        "peakRssMb": peak_rss_mb(),
+        "trackedPeople": results["totalPeople"],
+    }
+
+
+def run_isolated(scenario):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_scenario, scenario).result()
+
+
+def measure_startup(video, runs=IMPORT_RUNS):
+    """Import time of the analyzer in a fresh interpreter (best of runs), the
+    heavy modules that import loaded, and the time of a --probe of video."""
+    code = ("import sys, time, json; start = time.perf_counter(); import video_analyzer; "
+            "print(json.dumps([(time.perf_counter() - start) * 1000, "
+            f"[name for name in {HEAVY_MODULES!r} if name in sys.modules]]))")
+    path = [os.path.dirname(os.path.abspath(va.__file__)), os.environ.get("PYTHONPATH")]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in path if p))
+    import_ms = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                check=True).stdout
+        elapsed, heavy = json.loads(output)
+        import_ms.append(elapsed)
+
+    start = time.perf_counter()
+    va.probe_video(video)
+    return {"importMs": round(min(import_ms), 1), "heavyModulesLoaded": heavy,
+            "probeMs": round((time.perf_counter() - start) * 1000, 1)}
+
+
+# ===============================
+# REPORTING
+# ===============================
+def scenario_key(report):
+    return f"{report['mode']} {report['resolution'][0]}x{report['resolution'][1]} people={report['peopleInScene']}"
+
+
+def compare_to_baseline(reports, baseline_path, tolerance=REGRESSION_TOLERANCE):
+    """Scenarios whose fps fell more than tolerance below the baseline report's."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {scenario_key(r): r for r in json.load(f)["scenarios"]}
+    regressions = []
+    for report in reports:
+        before = baseline.get(scenario_key(report))
+        if before and before["fps"] and report["fps"] < before["fps"] * (1 - tolerance):
+            regressions.append({"scenario": scenario_key(report), "fps": report["fps"],
+                                "baselineFps": before["fps"]})
+    return regressions
+
+
+def print_table(reports):
+    stages = sorted({stage for r in reports for stage in r["stagesMs"]})
+    header = ["scenario", "fps", "peak MB", "det/frame", "tracks/frame"] + [f"{s} ms" for s in stages]
+    rows = [[scenario_key(r), str(r["fps"]), str(r["peakRssMb"]),
+             str(r["perFrame"].get("detections", "")), str(r["perFrame"].get("activeTracks", ""))] +
+            [str(r["stagesMs"].get(s, "")) for s in stages] for r in reports]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def parse_resolution(text):
+    width, _, height = text.lower().partition("x")
+    try:
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, e.g. 1920x1080")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MKMN Video Analyzer benchmark (synthetic footage, stub detector)")
+    parser.add_argument("--people", type=int, nargs="+", default=BENCH_PEOPLE,
+                        help="People in the scene, one run per value (crowd scaling)")
+    parser.add_argument("--resolution", type=parse_resolution, nargs="+", default=BENCH_RESOLUTIONS,
+                        metavar="WxH", help="Synthetic video resolutions")
+    parser.add_argument("--seconds", type=float, default=BENCH_SECONDS, help="Synthetic video length")
+    parser.add_argument("--fps", type=int, default=BENCH_FPS, help="Synthetic video frame rate")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED)
+    parser.add_argument("--infer-ms", type=float, default=0.0,
+                        help="Simulated detector time per frame (0 = stub cost only)")
+    parser.add_argument("--render", action="store_true", help="Also draw and encode the annotated video")
+    parser.add_argument("--tracker-only", action="store_true",
+                        help="Also feed the exact detection stream straight to the tracker (no decode/detect)")
+    parser.add_argument("--pipeline", action="store_true", help="Threaded pipeline (stage times overlap)")
+    parser.add_argument("--batch-size", type=int, default=va.DETECTION_BATCH_SIZE)
+    parser.add_argument("--detect-stride", type=int, default=None)
+    parser.add_argument("--working-size", type=va.parse_working_size, default=None, metavar="WIDTH[xHEIGHT]")
+    parser.add_argument("--profile", help="Camera profile JSON passed to the analyzer")
+    parser.add_argument("--video-dir", help="Keep the synthetic videos here (default: a temp dir, removed)")
+    parser.add_argument("--output-json", help="Write the full report here")
+    parser.add_argument("--baseline", help="Earlier --output-json report: exit 1 on fps regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Allowed fps drop against --baseline (share)")
+    args = parser.parse_args()
+
+    options = {
+        "profile": args.profile,
+        "batch_size": args.batch_size,
+        "pipeline": args.pipeline,
+        "detect_stride": args.detect_stride,
+        "working_size": args.working_size,
+    }
+    temp_dir = None
+    video_dir = args.video_dir
+    if not video_dir:
+        temp_dir = tempfile.TemporaryDirectory()
+        video_dir = temp_dir.name
+    os.makedirs(video_dir, exist_ok=True)
+
+    reports = []
+    startup = None
+    try:
+        for width, height in args.resolution:
+            for people in args.people:
+                scenario = {"resolution": (width, height), "people": people, "fps": args.fps,
+                            "seconds": args.seconds, "seed": args.seed}
+                runs = [dict(scenario, mode="tracker")] if args.tracker_only else []
+
+                video = os.path.join(video_dir, f"synthetic-{width}x{height}-{people}p-{args.seed}.mp4")
+                if not os.path.exists(video):
+                    SyntheticScene(people, width, height, args.fps, args.seconds, args.seed).write_video(video)
+                runs.append(dict(scenario, mode="video", video=video, render=args.render,
+                                 infer_ms=args.infer_ms, options=options))
+
+                for run in runs:
+                    report = run_isolated(run)
+                    report.update(mode=run["mode"], resolution=[width, height], peopleInScene=people)
+                    reports.append(report)
+                    print(f"{scenario_key(report)}: {report['fps']} fps, peak {report['peakRssMb']} MB",
+                          file=sys.stderr)
+        startup = measure_startup(video)
+    finally:
+        if temp_dir:
+            temp_dir.cleanup()
+
+    print_table(reports)
+    print(f"import video_analyzer: {startup['importMs']} ms, "
+          f"detector modules loaded: {', '.join(startup['heavyModulesLoaded']) or 'none'}, "
+          f"probe: {startup['probeMs']} ms")
+    summary = {"scenarios": reports, "startup": startup,
+               "options": {k: v for k, v in vars(args).items() if k != "baseline"}}
+    if args.output_json:
+        with open(args.output_json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare_to_baseline(reports, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['scenario']}: {regression['fps']} fps "
+                  f"(baseline {regression['baselineFps']})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()